@@ -34,6 +34,9 @@ def parse_arguments():
   
   # データディレクトリを指定
   python3 bin/aggregate.py --hours 12 --data-dir /path/to/data --output memory_12h.tsv
+  
+  # 縦持ち形式（1行1ローソク足）で出力
+  python3 bin/aggregate.py --days 7 --format long --output memory_1week_long.tsv
         """
     )
     
@@ -69,6 +72,12 @@ def parse_arguments():
         required=True,
         help="出力TSVファイル名"
     )
+    parser.add_argument(
+        "--format",
+        choices=["wide", "long"],
+        default="wide",
+        help="出力形式（wide: 時間×PIDの横持ち, long: 1行1ローソク足の縦持ち）（デフォルト: wide）"
+    )
     parser.add_argument(
         "--data-dir",
         type=str,
@@ -126,6 +135,7 @@ def main():
             print(f"データディレクトリ: {args.data_dir}", file=sys.stderr, flush=True)
             print(f"集計間隔: {args.interval}分", file=sys.stderr, flush=True)
             print(f"出力ファイル: {args.output}", file=sys.stderr, flush=True)
+            print(f"出力形式: {args.format}", file=sys.stderr, flush=True)
         
         # 時間範囲の計算
         start_time, end_time = calculate_time_range(args)
@@ -155,7 +165,10 @@ def main():
         if args.verbose:
             print("TSVファイルの出力を開始...", file=sys.stderr, flush=True)
         
-        tsv_file, mapping_file = aggregator.export_to_tsv(candle_data, args.output)
+        if args.format == "long":
+            tsv_file, mapping_file = aggregator.export_to_long_tsv(candle_data, args.output)
+        else:
+            tsv_file, mapping_file = aggregator.export_to_tsv(candle_data, args.output)
         
         # 完了メッセージ
         print(f"集計完了", file=sys.stderr, flush=True)
@@ -164,11 +177,7 @@ def main():
         
         # 統計情報の表示
         total_pids = len(candle_data)
-        total_time_points = len(set(
-            candle.timestamp 
-            for pid_candles in candle_data.values() 
-            for candle in pid_candles
-        ))
+        total_time_points = len(aggregator.last_timestamps)
         
         print(f"PID数: {total_pids}件", file=sys.stderr, flush=True)
         print(f"時間ポイント数: {total_time_points}件", file=sys.stderr, flush=True)
@@ -180,7 +189,8 @@ def main():
             
             for pid, pid_candles in candle_data.items():
                 if pid_candles:
-                    latest_candle = max(pid_candles, key=lambda x: x.timestamp)
+                    # ローソク足は時系列順に並んでいるため末尾が最新
+                    latest_candle = pid_candles[-1]
                     latest_values.append((pid, latest_candle.close_value))
             
             latest_values.sort(key=lambda x: x[1], reverse=True)
@@ -5,20 +5,49 @@ JSONファイルから15分足ローソク足を生成し、TSVファイルと
 """
 
 import json
+import mmap
 import os
+import re
 import sys
 import traceback
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Dict, List, Any, Tuple, Optional
 import glob
 
+try:
+    import orjson  # 高速JSONパーサー（未インストール時は標準jsonを使用）
+except ImportError:
+    orjson = None
+
+
+# データファイル名（memory_YYYYMMDD_HHMMSS.json）のパターン
+_DATA_FILENAME_RE = re.compile(r"memory_(\d{8})_(\d{6})\.json")
+
+# TSV出力時の書き込みバッファサイズ（1MiB）
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# JSONファイル読み込みの同時実行数（I/O待ちを隠蔽するためCPU数より多めに確保）
+READ_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# mmapで読み込むファイルサイズの下限（1MiB）。通常の数KBのスナップショットは
+# fstat+mmap+munmapより1回のread()の方が速く、mmapではページフォルトによるI/Oが
+# GILを保持したままのパース中に発生して並列読み込みを妨げるため
+MMAP_MIN_FILE_SIZE = 1 << 20
+
+# データが無い時刻のローソク足4値（空欄4つ分）
+EMPTY_CANDLE_CELLS = "\t\t\t"
+
 
 class ProcessDataPoint:
     """プロセスデータポイントクラス"""
     
-    def __init__(self, timestamp: datetime, pid: int, cmd: str, rss: int):
-        self.timestamp = timestamp
+    # レコード数が多いため__dict__を持たせずメモリ使用量を抑える
+    __slots__ = ("ts_epoch", "pid", "cmd", "rss")
+    
+    def __init__(self, ts_epoch: int, pid: int, cmd: str, rss: int):
+        self.ts_epoch = ts_epoch  # UNIXエポック秒
         self.pid = pid
         self.cmd = cmd
         self.rss = rss
@@ -27,29 +56,34 @@ class ProcessDataPoint:
 class CandleData:
     """ローソク足データクラス"""
     
+    __slots__ = ("timestamp", "open_value", "close_value", "high_value", "low_value", "sample_count")
+    
     def __init__(self, timestamp: datetime):
         self.timestamp = timestamp
         self.open_value = 0
         self.close_value = 0
         self.high_value = 0
         self.low_value = 0
-        self.data_points = []
+        self.sample_count = 0
     
-    def add_data_point(self, rss: int):
-        """データポイントを追加"""
-        self.data_points.append(rss)
-        
-        if len(self.data_points) == 1:
-            # 最初のデータポイント
-            self.open_value = rss
-            self.close_value = rss
-            self.high_value = rss
-            self.low_value = rss
-        else:
-            # 2個目以降のデータポイント
-            self.close_value = rss
-            self.high_value = max(self.high_value, rss)
-            self.low_value = min(self.low_value, rss)
+    def set_values(self, values: List[int]):
+        """時系列順の値リストから4値をまとめて設定"""
+        self.sample_count = len(values)
+        self.open_value = values[0]
+        self.close_value = values[-1]
+        self.high_value = max(values)
+        self.low_value = min(values)
+
+
+class SnapshotData:
+    """収集データ1ファイル分のクラス（集計に必要な項目のみ保持）"""
+    
+    __slots__ = ("ts_epoch", "timestamp", "items")
+    
+    def __init__(self, ts_epoch: Optional[int], timestamp: str, items: List[Tuple[Any, str, int]]):
+        self.ts_epoch = ts_epoch
+        self.timestamp = timestamp
+        self.items = items  # (pid, cmd, rss) のタプル
 
 
 class MemoryAggregator:
@@ -59,6 +93,8 @@ class MemoryAggregator:
         self.data_directory = data_directory
         self.pid_cmd_mapping = {}  # PID重複管理
         self.pid_counters = {}  # PID連番管理
+        self._pid_str_cache = {}  # PID→文字列の変換キャッシュ
+        self.last_timestamps = []  # 直近の集計で得られた時間軸（時系列順）
     
     def aggregate_to_candles(self, start_time: datetime, end_time: datetime, 
                            interval_minutes: int = 15) -> Dict[str, List[CandleData]]:
@@ -112,61 +148,83 @@ class MemoryAggregator:
             
             sorted_timestamps = sorted(all_timestamps)
             
-            # TSVファイルの書き込み
-            tsv_lines = []
+            normalized_output_file = self._normalize_output_file(output_file)
             
-            # ヘッダー行（ローソク足4値を展開）
-            header = ["時間"]
-            for pid in pid_list:
-                header.extend([f"{pid}_始値", f"{pid}_高値", f"{pid}_安値", f"{pid}_終値"])
-            tsv_lines.append("\t".join(header))
+            # PIDごとに時刻→ローソク足4値（整形済み文字列）の索引を作成
+            # セル毎の線形探索とstr変換の繰り返しを回避する
+            cell_index = [
+                {
+                    candle.timestamp: f"{candle.open_value}\t{candle.high_value}\t"
+                                      f"{candle.low_value}\t{candle.close_value}"
+                    for candle in candle_data[pid]
+                }
+                for pid in pid_list
+            ]
             
-            # データ行
-            for timestamp in sorted_timestamps:
-                row = [timestamp.strftime("%Y-%m-%d %H:%M:%S")]
-                
+            # TSVファイル書き込み（行を溜め込まず、バッファ付きで逐次書き込み）
+            with open(normalized_output_file, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as f:
+                # ヘッダー行（ローソク足4値を展開）
+                header = ["時間"]
                 for pid in pid_list:
-                    open_val = high_val = low_val = close_val = ""
-                    if pid in candle_data:
-                        for candle in candle_data[pid]:
-                            if candle.timestamp == timestamp:
-                                # ローソク足4値を設定
-                                open_val = str(candle.open_value)
-                                high_val = str(candle.high_value)
-                                low_val = str(candle.low_value)
-                                close_val = str(candle.close_value)
-                                break
-                    
-                    # 始値、高値、安値、終値の順で追加
-                    row.extend([open_val, high_val, low_val, close_val])
+                    header.extend([f"{pid}_始値", f"{pid}_高値", f"{pid}_安値", f"{pid}_終値"])
+                f.write("\t".join(header))
                 
-                tsv_lines.append("\t".join(row))
+                # データ行（始値、高値、安値、終値の順。データが無いセルは空欄）
+                for timestamp in sorted_timestamps:
+                    row = [timestamp.strftime("%Y-%m-%d %H:%M:%S")]
+                    row.extend(cells.get(timestamp, EMPTY_CANDLE_CELLS) for cells in cell_index)
+                    
+                    f.write("\n")
+                    f.write("\t".join(row))
             
-            # 出力ファイル名の正規化（.tsv拡張子の確保）
-            if not output_file.endswith('.tsv'):
-                normalized_output_file = output_file + '.tsv'
-            else:
-                normalized_output_file = output_file
+            # PID-CMD対応表の作成
+            mapping_file = self._write_pid_mapping(normalized_output_file, pid_list)
             
-            # TSVファイル書き込み
-            with open(normalized_output_file, 'w', encoding='utf-8') as f:
-                f.write("\n".join(tsv_lines))
+            print(f"TSVファイル出力完了: {normalized_output_file}", file=sys.stderr, flush=True)
+            print(f"PID対応表出力完了: {mapping_file}", file=sys.stderr, flush=True)
+            print(f"時間軸: {len(sorted_timestamps)}件, PID軸: {len(pid_list)}件", 
+                  file=sys.stderr, flush=True)
             
-            # PID-CMD対応表の作成
-            base_name = normalized_output_file.replace('.tsv', '')
-            mapping_file = base_name + '_pid_mapping.tsv'
-            mapping_lines = ["PID\tCOMMAND"]
+            return normalized_output_file, mapping_file
             
-            for pid in pid_list:
-                cmd = self.pid_cmd_mapping.get(self._extract_original_pid(pid), "unknown")
-                mapping_lines.append(f"{pid}\t{cmd}")
+        except Exception as e:
+            print(f"エラー: TSV出力中にエラーが発生しました: {repr(e)}", 
+                  file=sys.stderr, flush=True)
+            traceback.print_exc(file=sys.stderr)
+            raise
+    
+    def export_to_long_tsv(self, candle_data: Dict[str, List[CandleData]], 
+                           output_file: str) -> Tuple[str, str]:
+        """
+        ローソク足データを縦持ち形式（1行1ローソク足）のTSVファイルとPID-CMD対応表として出力
+        データが存在するローソク足のみを出力するため、PID数が多い場合も空欄で肥大化しない
+        """
+        try:
+            print(f"TSVファイル出力開始（縦持ち形式）: {output_file}", file=sys.stderr, flush=True)
             
-            with open(mapping_file, 'w', encoding='utf-8') as f:
-                f.write("\n".join(mapping_lines))
+            # PID一覧の取得
+            pid_list = sorted(candle_data.keys(), key=lambda x: self._extract_original_pid(x))
+            
+            normalized_output_file = self._normalize_output_file(output_file)
+            
+            # TSVファイル書き込み（PIDごとに時系列順で出力）
+            row_count = 0
+            with open(normalized_output_file, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as f:
+                f.write("時間\tPID\t始値\t高値\t安値\t終値")
+                
+                for pid in pid_list:
+                    for candle in candle_data[pid]:
+                        f.write(f"\n{candle.timestamp.strftime('%Y-%m-%d %H:%M:%S')}\t{pid}\t"
+                                f"{candle.open_value}\t{candle.high_value}\t"
+                                f"{candle.low_value}\t{candle.close_value}")
+                        row_count += 1
+            
+            # PID-CMD対応表の作成
+            mapping_file = self._write_pid_mapping(normalized_output_file, pid_list)
             
             print(f"TSVファイル出力完了: {normalized_output_file}", file=sys.stderr, flush=True)
             print(f"PID対応表出力完了: {mapping_file}", file=sys.stderr, flush=True)
-            print(f"時間軸: {len(sorted_timestamps)}件, PID軸: {len(pid_list)}件", 
+            print(f"ローソク足: {row_count}件, PID軸: {len(pid_list)}件", 
                   file=sys.stderr, flush=True)
             
             return normalized_output_file, mapping_file
@@ -177,54 +235,129 @@ class MemoryAggregator:
             traceback.print_exc(file=sys.stderr)
             raise
     
-    def _load_json_files(self, start_time: datetime, end_time: datetime) -> List[Dict[str, Any]]:
-        """指定期間のJSONファイルを読み込み"""
-        json_files = []
+    def _normalize_output_file(self, output_file: str) -> str:
+        """出力ファイル名の正規化（.tsv拡張子の確保）"""
+        if not output_file.endswith('.tsv'):
+            return output_file + '.tsv'
+        return output_file
+    
+    def _write_pid_mapping(self, normalized_output_file: str, pid_list: List[str]) -> str:
+        """PID-CMD対応表を出力し、そのファイル名を返す"""
+        base_name = normalized_output_file.replace('.tsv', '')
+        mapping_file = base_name + '_pid_mapping.tsv'
         
+        with open(mapping_file, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as f:
+            f.write("PID\tCOMMAND")
+            for pid in pid_list:
+                cmd = self.pid_cmd_mapping.get(self._extract_original_pid(pid), "unknown")
+                f.write(f"\n{pid}\t{cmd}")
+        
+        return mapping_file
+    
+    def _load_json_files(self, start_time: datetime, end_time: datetime) -> List[SnapshotData]:
+        """指定期間のJSONファイルを読み込み"""
         # JSONファイルのパターンマッチング
         pattern = os.path.join(self.data_directory, "memory_*.json")
-        file_paths = glob.glob(pattern)
         
-        for file_path in file_paths:
+        # ファイル名は時刻順に辞書順ソート可能なため、文字列比較で期間外のファイルを除外
+        start_name = start_time.strftime("memory_%Y%m%d_%H%M%S")
+        end_name = end_time.strftime("memory_%Y%m%d_%H%M%S")
+        
+        target_paths = []
+        for file_path in glob.iglob(pattern):
+            filename = os.path.basename(file_path)
+            if not (start_name <= filename[:22] <= end_name):
+                continue
+            
             try:
-                # ファイル名から時刻を抽出
-                filename = os.path.basename(file_path)
-                if filename.startswith("memory_") and filename.endswith(".json"):
-                    time_part = filename[7:22]  # memory_20250604_123456.json の時刻部分
-                    file_time = datetime.strptime(time_part, "%Y%m%d_%H%M%S")
-                    
-                    # 期間内のファイルのみ処理
-                    if start_time <= file_time <= end_time:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                            json_files.append(data)
+                # ファイル名から時刻を抽出（memory_20250604_123456.json の時刻部分）
+                file_time = self._parse_filename_time(filename)
+                
+                # 期間内のファイルのみ処理
+                if start_time <= file_time <= end_time:
+                    target_paths.append(file_path)
                 
             except Exception as e:
                 print(f"警告: JSONファイル読み込みエラー: {file_path} - {repr(e)}", 
                       file=sys.stderr, flush=True)
                 continue
         
-        return json_files
+        if not target_paths:
+            return []
+        
+        # ファイル名は時刻順にソート可能なため、ここで1回だけソートして以降の処理を時系列順にする
+        target_paths.sort()
+        
+        # 各ファイルは独立しているため、読み込みとパースを並列に実行
+        # ディスク待ちを重ね合わせるため、CPU数より多くの読み込みを同時に発行する
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+            results = list(executor.map(self._read_json_file, target_paths))
+        
+        return [data for data in results if data is not None]
+    
+    def _parse_filename_time(self, filename: str) -> datetime:
+        """データファイル名から時刻を取得（strptimeより軽量な正規表現と整数変換で解釈）"""
+        match = _DATA_FILENAME_RE.fullmatch(filename)
+        if match is None:
+            raise ValueError(f"ファイル名の形式が不正です: {filename}")
+        
+        date_part, time_part = match.groups()
+        return datetime(int(date_part[0:4]), int(date_part[4:6]), int(date_part[6:8]),
+                        int(time_part[0:2]), int(time_part[2:4]), int(time_part[4:6]))
     
-    def _extract_process_data(self, raw_data: List[Dict[str, Any]]) -> List[ProcessDataPoint]:
+    def _read_json_file(self, file_path: str) -> Optional[SnapshotData]:
+        """JSONファイルを1件読み込み（エラー時はNoneを返す）"""
+        try:
+            with open(file_path, 'rb') as f:
+                # 大きなファイルのみmmapし、orjsonにmemoryviewを渡してユーザー空間へのコピーを省略
+                if orjson is not None and os.fstat(f.fileno()).st_size >= MMAP_MIN_FILE_SIZE:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        with memoryview(mm) as view:
+                            data = orjson.loads(view)
+                else:
+                    data = self._parse_json_bytes(f.read())
+            
+            # 不要な項目（hostname, group, 合計値等）を含む辞書はここで破棄する
+            return self._to_snapshot(data)
+        except Exception as e:
+            print(f"警告: JSONファイル読み込みエラー: {file_path} - {repr(e)}", 
+                  file=sys.stderr, flush=True)
+            return None
+    
+    def _parse_json_bytes(self, raw: bytes) -> Dict[str, Any]:
+        """JSONバイト列をパース（orjsonが利用可能な場合は優先して使用）"""
+        if orjson is not None:
+            return orjson.loads(raw)
+        return json.loads(raw)
+    
+    def _to_snapshot(self, data: Dict[str, Any]) -> SnapshotData:
+        """パース済みJSONから集計に必要な項目のみを取り出す"""
+        items = [
+            (item.get("pid"), sys.intern(item.get("cmd", "")), item.get("rss", 0))
+            for item in data.get("items", [])
+        ]
+        return SnapshotData(data.get("ts_epoch"), data.get("timestamp", ""), items)
+    
+    def _extract_process_data(self, raw_data: List[SnapshotData]) -> List[ProcessDataPoint]:
         """JSONデータからプロセスデータを抽出"""
         process_data = []
         
         for data in raw_data:
             try:
-                timestamp_str = data.get("timestamp", "")
-                timestamp = datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
+                # タイムスタンプはファイル単位で1回だけ解釈し、エポック秒で保持する
+                # ts_epochが無い古いファイルはISO形式をパースして変換
+                ts_epoch = data.ts_epoch
+                if ts_epoch is None:
+                    timestamp = datetime.fromisoformat(data.timestamp.replace("Z", "+00:00"))
+                    ts_epoch = int(timestamp.timestamp())
                 
-                for item in data.get("items", []):
-                    pid = item.get("pid")
-                    cmd = item.get("cmd", "")
-                    rss = item.get("rss", 0)
-                    
+                # cmdは読み込み時にinternされ、同一コマンド文字列は1つのオブジェクトを共有
+                for pid, cmd, rss in data.items:
                     if pid is not None:
                         # PID重複処理
                         normalized_pid = self._handle_pid_duplication(pid, cmd)
                         
-                        process_data.append(ProcessDataPoint(timestamp, normalized_pid, cmd, rss))
+                        process_data.append(ProcessDataPoint(ts_epoch, normalized_pid, cmd, rss))
                 
             except Exception as e:
                 print(f"警告: プロセスデータ抽出エラー: {repr(e)}", file=sys.stderr, flush=True)
@@ -234,14 +367,18 @@ class MemoryAggregator:
     
     def _handle_pid_duplication(self, pid: int, cmd: str) -> str:
         """PID重複処理（同一PIDで異なるコマンドの場合、連番を付与）"""
+        pid_str = self._pid_str_cache.get(pid)
+        if pid_str is None:
+            pid_str = self._pid_str_cache[pid] = str(pid)
+        
         if pid not in self.pid_cmd_mapping:
             # 初回登録
             self.pid_cmd_mapping[pid] = cmd
-            return str(pid)
+            return pid_str
         
         if self.pid_cmd_mapping[pid] == cmd:
             # 同じコマンドなので通常のPID
-            return str(pid)
+            return pid_str
         else:
             # 異なるコマンドなので連番を付与
             if pid not in self.pid_counters:
@@ -254,44 +391,51 @@ class MemoryAggregator:
             return new_pid
     
     def _group_by_time_interval(self, process_data: List[ProcessDataPoint], 
-                              interval_minutes: int) -> Dict[Tuple[datetime, str], List[ProcessDataPoint]]:
-        """時間間隔でプロセスデータをグループ化"""
+                              interval_minutes: int) -> Dict[Tuple[int, str], List[int]]:
+        """
+        時間間隔でプロセスデータをグループ化
+        キーは時間間隔の開始エポック秒とPID、値はRSSの時系列順リスト
+        """
         groups = {}
+        interval_seconds = interval_minutes * 60
         
         for data_point in process_data:
-            # 時間間隔の開始時刻を計算
-            minute = (data_point.timestamp.minute // interval_minutes) * interval_minutes
-            interval_start = data_point.timestamp.replace(minute=minute, second=0, microsecond=0)
+            # 時間間隔の開始時刻を整数演算で計算（datetimeオブジェクトを生成しない）
+            ts_epoch = data_point.ts_epoch
+            interval_start = ts_epoch - ts_epoch % interval_seconds
             
             key = (interval_start, data_point.pid)
-            if key not in groups:
-                groups[key] = []
-            groups[key].append(data_point)
+            rss_values = groups.get(key)
+            if rss_values is None:
+                groups[key] = [data_point.rss]
+            else:
+                rss_values.append(data_point.rss)
         
         return groups
     
-    def _generate_candles(self, time_groups: Dict[Tuple[datetime, str], List[ProcessDataPoint]]) -> Dict[str, List[CandleData]]:
+    def _generate_candles(self, time_groups: Dict[Tuple[int, str], List[int]]) -> Dict[str, List[CandleData]]:
         """時間グループからローソク足データを生成"""
         candle_data = {}
+        bucket_times = {}  # 時間間隔の開始エポック秒→datetime
         
-        for (timestamp, pid), data_points in time_groups.items():
+        for (interval_start, pid), rss_values in time_groups.items():
             if pid not in candle_data:
                 candle_data[pid] = []
             
-            # ローソク足の作成
+            # ローソク足の作成（datetimeへの変換は時間間隔ごとに1回のみ）
+            timestamp = bucket_times.get(interval_start)
+            if timestamp is None:
+                timestamp = bucket_times[interval_start] = datetime.fromtimestamp(interval_start, timezone.utc)
             candle = CandleData(timestamp)
             
-            # 時系列順にソート
-            sorted_points = sorted(data_points, key=lambda x: x.timestamp)
-            
-            for point in sorted_points:
-                candle.add_data_point(point.rss)
+            # 読み込み時にファイルを時系列順にソート済みのため、グループ内もグループ間も
+            # 追加順が時系列順となる（再ソート不要）
+            candle.set_values(rss_values)
             
             candle_data[pid].append(candle)
         
-        # 各PIDのローソク足を時系列順にソート
-        for pid in candle_data:
-            candle_data[pid].sort(key=lambda x: x.timestamp)
+        # 時間軸を記録（呼び出し側で全ローソク足を走査せずに済むように）
+        self.last_timestamps = [bucket_times[key] for key in sorted(bucket_times)]
         
         return candle_data
     
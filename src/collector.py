@@ -1,16 +1,24 @@
 #!/usr/bin/env python3
 """
 メモリ情報収集モジュール
-psコマンドでプロセス情報を取得し、構造化して返す
+/proc（利用できない環境ではpsコマンド）からプロセス情報を取得し、構造化して返す
 """
 
+import heapq
+import logging
+import os
 import subprocess
 import sys
-import traceback
+import time
 import socket
 from datetime import datetime, timezone
 from typing import List, Dict, Any, Optional
 
+logger = logging.getLogger(__name__)
+
+# /proc/[pid]/cmdlineの区切り文字（NUL）や改行等の制御文字を空白に変換するテーブル（ps の表示に合わせる）
+_CONTROL_CHARS_TO_SPACE = {code: " " for code in range(0x20)}
+
 
 class ProcessInfo:
     """プロセス情報クラス"""
@@ -28,24 +36,24 @@ class MemoryCollector:
     def __init__(self, top_count: int = 40, process_group_by: str = "command"):
         self.top_count = top_count
         self.process_group_by = process_group_by
+        
+        # ホスト名は稼働中に変化しないため、初期化時に1回だけ取得して毎回のcollect()で再利用する
         self.hostname = self._get_hostname()
+        
+        # Linuxでは/procを直接読み込み、psコマンドの起動とテキスト解析を省略する
+        self.use_proc = os.path.isdir("/proc/self")
+        self.page_size_kb = os.sysconf("SC_PAGE_SIZE") // 1024 if self.use_proc else 0
     
     def collect(self) -> Dict[str, Any]:
         """
         メモリ情報を収集して構造化データを返す
         """
         try:
-            # psコマンドでプロセス情報を取得
-            raw_processes = self._get_process_list()
-            
-            # プロセス情報の構造化
-            processes = self._parse_process_list(raw_processes)
+            # プロセス情報の取得と構造化
+            processes = self._get_processes()
             
-            # プロセスグループ化とソート
-            grouped_processes = self._group_and_sort_processes(processes)
-            
-            # 上位件数に絞り込み
-            top_processes = grouped_processes[:self.top_count]
+            # プロセスグループ化と上位件数の抽出
+            top_processes = self._group_and_sort_processes(processes)
             
             # 合計メモリ使用量の計算
             total_kb = sum(proc.rss for proc in top_processes)
@@ -54,8 +62,11 @@ class MemoryCollector:
             total_tb = total_gb / 1024
             
             # 構造化データの生成
+            # ts_epochは集計時にISO形式をパースせずに済むよう併せて出力する
+            now = time.time()
             result = {
-                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "timestamp": datetime.fromtimestamp(now, timezone.utc).isoformat(),
+                "ts_epoch": int(now),
                 "hostname": self.hostname,
                 "items": [
                     {
@@ -74,64 +85,105 @@ class MemoryCollector:
             return result
             
         except Exception as e:
-            print(f"エラー: メモリ情報収集中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("エラー: メモリ情報収集中にエラーが発生しました: %r", e)
             raise
     
+    def _get_processes(self) -> List[ProcessInfo]:
+        """プロセス情報の一覧を取得"""
+        if self.use_proc:
+            return self._read_proc_processes()
+        
+        # /procが無い環境ではpsコマンドを使用
+        return self._parse_process_list(self._get_process_list())
+    
+    def _read_proc_processes(self) -> List[ProcessInfo]:
+        """/proc/[pid]からプロセス情報を直接読み込む"""
+        processes = []
+        
+        with os.scandir("/proc") as entries:
+            for entry in entries:
+                if not entry.name.isdigit():
+                    continue
+                
+                try:
+                    pid = int(entry.name)
+                    
+                    # statmの2番目のフィールドが常駐ページ数
+                    with open(f"/proc/{pid}/statm", 'rb') as f:
+                        rss = int(f.read().split()[1]) * self.page_size_kb
+                    
+                    # cmdlineはNUL区切り。カーネルスレッド等で空の場合はpsと同様に[comm]とする
+                    with open(f"/proc/{pid}/cmdline", 'rb') as f:
+                        cmdline = f.read()
+                    if cmdline:
+                        command = cmdline.decode('utf-8', 'replace').translate(_CONTROL_CHARS_TO_SPACE).strip()
+                    else:
+                        with open(f"/proc/{pid}/comm", 'rb') as f:
+                            command = f"[{f.read().decode('utf-8', 'replace').strip()}]"
+                    
+                    group = self._determine_group(pid, command)
+                    processes.append(ProcessInfo(pid, self._simplify_command(command), rss, group))
+                    
+                except (FileNotFoundError, ProcessLookupError):
+                    # 読み込み中に終了したプロセスは無視
+                    continue
+                except (OSError, ValueError, IndexError) as e:
+                    logger.warning("警告: プロセス情報の読み込み中にエラーが発生しました: PID %s - %r",
+                                   entry.name, e)
+                    continue
+        
+        return processes
+    
     def _get_process_list(self) -> str:
         """psコマンドでプロセス一覧を取得"""
         try:
-            # ps aux --sort=-rss でメモリ使用量順にソート
-            cmd = ["ps", "aux", "--sort=-rss"]
+            # 必要な列（PID, RSS, COMMAND）のみをヘッダー無しで出力し、メモリ使用量順にソート
+            cmd = ["ps", "-eo", "pid=,rss=,args=", "--sort=-rss"]
             result = subprocess.run(cmd, capture_output=True, text=True, check=True)
             return result.stdout
             
         except subprocess.CalledProcessError as e:
-            print(f"エラー: psコマンドの実行に失敗しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
-            print(f"stderr: {e.stderr}", file=sys.stderr, flush=True)
+            logger.error("エラー: psコマンドの実行に失敗しました: %r", e)
+            logger.error("stderr: %s", e.stderr)
             raise
         except FileNotFoundError:
-            print("エラー: psコマンドが見つかりません", file=sys.stderr, flush=True)
+            logger.error("エラー: psコマンドが見つかりません")
             raise
     
     def _parse_process_list(self, ps_output: str) -> List[ProcessInfo]:
         """psコマンドの出力をパースしてProcessInfoのリストを返す"""
         processes = []
-        lines = ps_output.strip().split('\n')
+        lines = ps_output.splitlines()
         
-        # ヘッダー行をスキップ
-        if len(lines) < 2:
-            print("警告: psコマンドの出力が空です", file=sys.stderr, flush=True)
+        if not lines:
+            logger.warning("警告: psコマンドの出力が空です")
             return processes
         
-        for line in lines[1:]:  # ヘッダー行をスキップ
+        for line in lines:
             try:
                 process_info = self._parse_process_line(line)
                 if process_info:
                     processes.append(process_info)
             except Exception as e:
-                print(f"警告: プロセス行のパース中にエラーが発生しました: {repr(e)}", 
-                      file=sys.stderr, flush=True)
-                print(f"行: {line}", file=sys.stderr, flush=True)
+                logger.warning("警告: プロセス行のパース中にエラーが発生しました: %r", e)
+                logger.warning("行: %s", line)
                 continue
         
         return processes
     
     def _parse_process_line(self, line: str) -> Optional[ProcessInfo]:
         """プロセス行をパースしてProcessInfoを返す"""
-        # ps auxの出力形式:
-        # USER       PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND
-        parts = line.split(None, 10)  # 最大11個に分割（COMMANDにスペースが含まれる可能性があるため）
+        # ps -eo pid=,rss=,args= の出力形式:
+        #   PID   RSS COMMAND
+        parts = line.split(None, 2)  # 最大3個に分割（COMMANDにスペースが含まれる可能性があるため）
         
-        if len(parts) < 11:
+        if len(parts) < 3:
             return None
         
         try:
-            pid = int(parts[1])
-            rss = int(parts[5])  # RSS (KB)
-            command = parts[10].strip()
+            pid = int(parts[0])
+            rss = int(parts[1])  # RSS (KB)
+            command = parts[2].strip()
             
             # プロセスグループの決定
             group = self._determine_group(pid, command)
@@ -142,8 +194,7 @@ class MemoryCollector:
             return ProcessInfo(pid, simplified_cmd, rss, group)
             
         except (ValueError, IndexError) as e:
-            print(f"警告: プロセス情報のパース中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
+            logger.warning("警告: プロセス情報のパース中にエラーが発生しました: %r", e)
             return None
     
     def _determine_group(self, pid: int, command: str) -> str:
@@ -171,21 +222,20 @@ class MemoryCollector:
         return command
     
     def _group_and_sort_processes(self, processes: List[ProcessInfo]) -> List[ProcessInfo]:
-        """プロセスをグループ化してソート"""
+        """プロセスをグループ化し、メモリ使用量の上位件数をソートして返す"""
         if self.process_group_by == "command":
             # コマンド別にグループ化し、各グループで最大メモリ使用量のプロセスを選択
             groups = {}
             for proc in processes:
                 if proc.group not in groups or proc.rss > groups[proc.group].rss:
                     groups[proc.group] = proc
-            
-            # メモリ使用量でソート
-            grouped_processes = sorted(groups.values(), key=lambda x: x.rss, reverse=True)
+            candidates = groups.values()
         else:
-            # PIDの場合はそのままソート
-            grouped_processes = sorted(processes, key=lambda x: x.rss, reverse=True)
+            # PIDの場合はそのまま
+            candidates = processes
         
-        return grouped_processes
+        # 全件ソートせず、上位件数のみを抽出（メモリ使用量の降順）
+        return heapq.nlargest(self.top_count, candidates, key=lambda x: x.rss)
     
     def _get_hostname(self) -> str:
         """ホスト名を取得"""
@@ -201,6 +251,9 @@ def create_collector(top_count: int = 40, process_group_by: str = "command") ->
 
 
 if __name__ == "__main__":
+    # ログは標準エラー出力へ
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format="%(message)s")
+    
     # テスト実行
     collector = create_collector()
     
@@ -5,10 +5,60 @@ settings.jsonの読み込みとバリデーションを行う
 """
 
 import json
+import logging
 import os
 import sys
-import traceback
-from typing import Dict, Any, List
+from typing import Any, List
+
+try:
+    import orjson  # 高速JSONパーサー（未インストール時は標準jsonを使用）
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _is_int_in_range(minimum: int, maximum: int = None):
+    """整数かつ範囲内かを判定する関数を生成"""
+    if maximum is None:
+        return lambda value: isinstance(value, int) and value >= minimum
+    return lambda value: isinstance(value, int) and minimum <= value <= maximum
+
+
+_VALID_LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+
+# 設定スキーマ（モジュール読み込み時に一度だけ構築）
+# (セクション, キー, デフォルト値, 検証関数, エラーメッセージ, 展開先の属性名)
+CONFIG_SCHEMA = (
+    ("collection", "interval_seconds", 60, _is_int_in_range(10, 300),
+     "interval_secondsは10-300秒の範囲で設定してください: {}", "collection_interval"),
+    ("collection", "top_count", 40, _is_int_in_range(1, 1000),
+     "top_countは1-1000件の範囲で設定してください: {}", "top_count"),
+    ("collection", "process_group_by", "command", lambda value: value in ("command", "pid"),
+     "process_group_byは'command'または'pid'を設定してください: {}", "process_group_by"),
+    ("output", "directory", "./output", lambda value: True,
+     "", "output_directory"),
+    ("output", "file_retention_count", 1440, _is_int_in_range(1),
+     "file_retention_countは1以上を設定してください: {}", "file_retention_count"),
+    ("output", "cleanup_interval_seconds", 3600, _is_int_in_range(60),
+     "cleanup_interval_secondsは60秒以上を設定してください: {}", "cleanup_interval"),
+    ("output", "pretty_output", False, lambda value: isinstance(value, bool),
+     "pretty_outputはbool値を設定してください: {}", "pretty_output"),
+    # durable_writes: 有効時は保存毎にファイルと出力ディレクトリをfsyncする。
+    # 無効時（デフォルト）は電源断で直近のスナップショットを失う可能性があるが、収集周期毎の同期待ちが無くなる
+    ("output", "durable_writes", False, lambda value: isinstance(value, bool),
+     "durable_writesはbool値を設定してください: {}", "durable_writes"),
+    ("security", "allowed_output_paths", ["./output", "/tmp/process_memory"],
+     lambda value: isinstance(value, list) and len(value) > 0,
+     "allowed_output_pathsは空でない配列を設定してください", "allowed_output_paths"),
+    ("security", "max_file_size_mb", 100,
+     lambda value: isinstance(value, (int, float)) and value > 0,
+     "max_file_size_mbは正の数値を設定してください: {}", "max_file_size_mb"),
+    ("logging", "level", "INFO", lambda value: value in _VALID_LOG_LEVELS,
+     f"levelは{_VALID_LOG_LEVELS}のいずれかを設定してください: {{}}", "log_level"),
+    ("logging", "enable_debug", False, lambda value: isinstance(value, bool),
+     "enable_debugはbool値を設定してください: {}", "debug_enabled"),
+)
 
 
 class Config:
@@ -27,131 +77,52 @@ class Config:
         """設定ファイルを読み込む"""
         try:
             if not os.path.exists(self.config_path):
-                print(f"エラー: 設定ファイルが見つかりません: {self.config_path}", file=sys.stderr, flush=True)
+                logger.error("エラー: 設定ファイルが見つかりません: %s", self.config_path)
                 sys.exit(100)
             
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                self.config = json.load(f)
+            # バイト列として一括で読み込み、デコードせずにパーサーへ渡す
+            with open(self.config_path, 'rb') as f:
+                raw = f.read()
+            self.config = orjson.loads(raw) if orjson is not None else json.loads(raw)
                 
         except json.JSONDecodeError as e:
-            print(f"エラー: 設定ファイルのJSON形式が不正です: {repr(e)}", file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("エラー: 設定ファイルのJSON形式が不正です: %r", e)
             sys.exit(101)
         except Exception as e:
-            print(f"エラー: 設定ファイル読み込み中にエラーが発生しました: {repr(e)}", file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("エラー: 設定ファイル読み込み中にエラーが発生しました: %r", e)
             sys.exit(102)
     
     def _validate_config(self):
         """設定値のバリデーション"""
         try:
-            # デフォルト値の設定
-            defaults = {
-                "collection": {
-                    "interval_seconds": 60,
-                    "top_count": 40,
-                    "process_group_by": "command"
-                },
-                "output": {
-                    "directory": "./output",
-                    "file_retention_count": 1440,
-                    "cleanup_interval_seconds": 3600
-                },
-                "security": {
-                    "allowed_output_paths": ["./output", "/tmp/process_memory"],
-                    "max_file_size_mb": 100
-                },
-                "logging": {
-                    "level": "INFO",
-                    "enable_debug": False
-                }
-            }
-            
             # デフォルト値のマージ
-            self._merge_defaults(defaults)
+            self._merge_defaults()
+            
+            # スキーマに従ってバリデーション実行
+            for section, key, _, is_valid, message, _ in CONFIG_SCHEMA:
+                value = self.config[section][key]
+                if not is_valid(value):
+                    raise ValueError(message.format(value))
             
-            # バリデーション実行
-            self._validate_collection_settings()
-            self._validate_output_settings()
-            self._validate_security_settings()
-            self._validate_logging_settings()
+            # 検証済みの値を属性として保持
+            self._freeze_settings()
             
         except Exception as e:
-            print(f"エラー: 設定値バリデーション中にエラーが発生しました: {repr(e)}", file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("エラー: 設定値バリデーション中にエラーが発生しました: %r", e)
             sys.exit(103)
     
-    def _merge_defaults(self, defaults: Dict[str, Any]):
+    def _merge_defaults(self):
         """デフォルト値をマージ"""
-        for section, default_values in defaults.items():
-            if section not in self.config:
-                self.config[section] = {}
-            
-            for key, default_value in default_values.items():
-                if key not in self.config[section]:
-                    self.config[section][key] = default_value
-    
-    def _validate_collection_settings(self):
-        """収集設定のバリデーション"""
-        collection = self.config["collection"]
-        
-        # interval_secondsの範囲チェック
-        interval = collection["interval_seconds"]
-        if not isinstance(interval, int) or not (10 <= interval <= 300):
-            raise ValueError(f"interval_secondsは10-300秒の範囲で設定してください: {interval}")
-        
-        # top_countの範囲チェック
-        top_count = collection["top_count"]
-        if not isinstance(top_count, int) or not (1 <= top_count <= 1000):
-            raise ValueError(f"top_countは1-1000件の範囲で設定してください: {top_count}")
-        
-        # process_group_byの値チェック
-        group_by = collection["process_group_by"]
-        if group_by not in ["command", "pid"]:
-            raise ValueError(f"process_group_byは'command'または'pid'を設定してください: {group_by}")
-    
-    def _validate_output_settings(self):
-        """出力設定のバリデーション"""
-        output = self.config["output"]
-        
-        # file_retention_countの範囲チェック
-        retention = output["file_retention_count"]
-        if not isinstance(retention, int) or retention < 1:
-            raise ValueError(f"file_retention_countは1以上を設定してください: {retention}")
-        
-        # cleanup_interval_secondsの範囲チェック
-        cleanup_interval = output["cleanup_interval_seconds"]
-        if not isinstance(cleanup_interval, int) or cleanup_interval < 60:
-            raise ValueError(f"cleanup_interval_secondsは60秒以上を設定してください: {cleanup_interval}")
-    
-    def _validate_security_settings(self):
-        """セキュリティ設定のバリデーション"""
-        security = self.config["security"]
-        
-        # allowed_output_pathsの型チェック
-        allowed_paths = security["allowed_output_paths"]
-        if not isinstance(allowed_paths, list) or len(allowed_paths) == 0:
-            raise ValueError("allowed_output_pathsは空でない配列を設定してください")
-        
-        # max_file_size_mbの範囲チェック
-        max_size = security["max_file_size_mb"]
-        if not isinstance(max_size, (int, float)) or max_size <= 0:
-            raise ValueError(f"max_file_size_mbは正の数値を設定してください: {max_size}")
-    
-    def _validate_logging_settings(self):
-        """ログ設定のバリデーション"""
-        logging = self.config["logging"]
-        
-        # levelの値チェック
-        level = logging["level"]
-        valid_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
-        if level not in valid_levels:
-            raise ValueError(f"levelは{valid_levels}のいずれかを設定してください: {level}")
-        
-        # enable_debugの型チェック
-        debug = logging["enable_debug"]
-        if not isinstance(debug, bool):
-            raise ValueError(f"enable_debugはbool値を設定してください: {debug}")
+        for section, key, default_value, _, _, _ in CONFIG_SCHEMA:
+            section_values = self.config.setdefault(section, {})
+            if key not in section_values:
+                # リストは設定インスタンス間で共有しないよう複製する
+                section_values[key] = list(default_value) if isinstance(default_value, list) else default_value
+    
+    def _freeze_settings(self):
+        """検証済みの設定値を属性に展開（取得時の辞書参照を省略するため）"""
+        for section, key, _, _, _, attribute in CONFIG_SCHEMA:
+            setattr(self, attribute, self.config[section][key])
     
     def get(self, section: str, key: str = None) -> Any:
         """設定値を取得"""
@@ -161,43 +132,51 @@ class Config:
     
     def get_collection_interval(self) -> int:
         """収集間隔を取得"""
-        return self.config["collection"]["interval_seconds"]
+        return self.collection_interval
     
     def get_top_count(self) -> int:
         """上位件数を取得"""
-        return self.config["collection"]["top_count"]
+        return self.top_count
     
     def get_process_group_by(self) -> str:
         """プロセスグループ化方式を取得"""
-        return self.config["collection"]["process_group_by"]
+        return self.process_group_by
     
     def get_output_directory(self) -> str:
         """出力ディレクトリを取得"""
-        return self.config["output"]["directory"]
+        return self.output_directory
     
     def get_file_retention_count(self) -> int:
         """ファイル保持件数を取得"""
-        return self.config["output"]["file_retention_count"]
+        return self.file_retention_count
     
     def get_cleanup_interval(self) -> int:
         """クリーンアップ間隔を取得"""
-        return self.config["output"]["cleanup_interval_seconds"]
+        return self.cleanup_interval
+    
+    def is_pretty_output(self) -> bool:
+        """JSONを整形して出力するかを取得"""
+        return self.pretty_output
+    
+    def is_durable_writes(self) -> bool:
+        """保存毎にfsyncするかを取得"""
+        return self.durable_writes
     
     def get_allowed_output_paths(self) -> List[str]:
         """許可された出力パスを取得"""
-        return self.config["security"]["allowed_output_paths"]
+        return self.allowed_output_paths
     
     def get_max_file_size_mb(self) -> float:
         """最大ファイルサイズを取得"""
-        return self.config["security"]["max_file_size_mb"]
+        return self.max_file_size_mb
     
     def get_log_level(self) -> str:
         """ログレベルを取得"""
-        return self.config["logging"]["level"]
+        return self.log_level
     
     def is_debug_enabled(self) -> bool:
         """デバッグモードが有効かを取得"""
-        return self.config["logging"]["enable_debug"]
+        return self.debug_enabled
 
 
 def load_config(config_path: str = "settings.json") -> Config:
@@ -206,6 +185,9 @@ def load_config(config_path: str = "settings.json") -> Config:
 
 
 if __name__ == "__main__":
+    # ログは標準エラー出力へ
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format="%(message)s")
+    
     # テスト実行
     try:
         config = load_config()
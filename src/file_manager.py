@@ -4,24 +4,57 @@
 JSONファイルの原子性を保証した出力、古いファイルの削除、ディスク容量監視を行う
 """
 
+import errno
 import json
+import logging
 import os
 import sys
 import shutil
 import time
-import traceback
-from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+
+try:
+    import orjson  # 高速JSONシリアライザー（未インストール時は標準jsonを使用）
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Linuxのみ定義されるフラグ（未定義の環境では一時ファイル+os.replaceで保存）
+_O_TMPFILE = getattr(os, "O_TMPFILE", None)
+
+# O_TMPFILE非対応を示すエラー番号（古いカーネルはフラグを解釈できずEISDIRを返す）
+_O_TMPFILE_UNSUPPORTED_ERRNOS = (errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL)
+
+# 保存ファイル名のテンプレート（time.strftimeでローカル時刻を埋め込む）
+FILENAME_TEMPLATE = "memory_%Y%m%d_%H%M%S.json"
 
 
 class FileManager:
     """ファイル管理クラス"""
     
-    def __init__(self, output_directory: str, file_retention_count: int, max_file_size_mb: float):
+    def __init__(self, output_directory: str, file_retention_count: int, max_file_size_mb: float,
+                 pretty_output: bool = False, durable_writes: bool = False):
         self.output_directory = output_directory
         self.file_retention_count = file_retention_count
         self.max_file_size_mb = max_file_size_mb
+        self.pretty_output = pretty_output
+        self.durable_writes = durable_writes
+        
+        # 名前の無い一時ファイル（O_TMPFILE）を/proc/self/fd経由でリンクするためのディレクトリFD
+        # （dir_fdを指定しないとos.linkはlinkatを使わず、シンボリックリンクを辿れない）
+        self._proc_fd_dir = None
+        if _O_TMPFILE is not None:
+            try:
+                self._proc_fd_dir = os.open("/proc/self/fd", os.O_RDONLY | os.O_DIRECTORY)
+            except OSError:
+                pass
+        self._use_tmpfile = self._proc_fd_dir is not None
+        
+        # JSONファイル一覧のキャッシュ（新しい順）。Noneの場合は次回取得時にディレクトリを走査
+        self._cached_files = None
+        
         self._ensure_output_directory()
     
     def save_json(self, data: Dict[str, Any]) -> str:
@@ -30,77 +63,185 @@ class FileManager:
         """
         try:
             # ファイル名の生成 (タイムスタンプベース)
-            timestamp = datetime.now()
-            filename = f"memory_{timestamp.strftime('%Y%m%d_%H%M%S')}.json"
+            filename = time.strftime(FILENAME_TEMPLATE)
             filepath = os.path.join(self.output_directory, filename)
             
-            # 原子性を保証するため、一時ファイルに書き込み後にrename
-            temp_filepath = filepath + ".tmp"
-            
-            # JSONデータの書き込み
-            with open(temp_filepath, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-                f.flush()  # バッファを強制的にフラッシュ
-                os.fsync(f.fileno())  # OSレベルでの書き込み保証
+            # JSONデータの書き込み（シリアライズ済みのバイト列をまとめて出力）
+            payload = self._serialize_json(data)
+            self._write_atomic(filepath, payload)
             
-            # 原子的にファイル名を変更
-            os.rename(temp_filepath, filepath)
+            # ファイル一覧キャッシュの先頭（最新）に追加
+            if self._cached_files is not None and filepath not in self._cached_files[:1]:
+                self._cached_files.insert(0, filepath)
             
-            # ファイルサイズチェック
-            file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
+            # ファイルサイズチェック（書き込んだバイト数から算出）
+            file_size_mb = len(payload) / (1024 * 1024)
             if file_size_mb > self.max_file_size_mb:
-                print(f"警告: ファイルサイズが制限を超えています: {filepath} ({file_size_mb:.2f}MB)", 
-                      file=sys.stderr, flush=True)
+                logger.warning("警告: ファイルサイズが制限を超えています: %s (%.2fMB)",
+                               filepath, file_size_mb)
             
-            print(f"ファイル保存完了: {filepath} ({file_size_mb:.2f}MB)", 
-                  file=sys.stderr, flush=True)
+            # 毎周期の出力のため、デバッグレベル無効時は文字列を組み立てない
+            logger.debug("ファイル保存完了: %s (%.2fMB)", filepath, file_size_mb)
             
             return filepath
             
         except Exception as e:
+            logger.exception("エラー: JSONファイル保存中にエラーが発生しました: %r", e)
+            raise
+    
+    def close(self):
+        """/proc/self/fdのディレクトリFDを閉じる（以降の保存は一時ファイル+os.replaceで行う）"""
+        self._use_tmpfile = False
+        if self._proc_fd_dir is not None:
+            os.close(self._proc_fd_dir)
+            self._proc_fd_dir = None
+    
+    def _write_atomic(self, filepath: str, payload: bytes):
+        """
+        バイト列を原子的にファイルへ書き込む
+        
+        Linuxでは名前の無い一時ファイル（O_TMPFILE）に書き込んでからリンクするため、
+        異常終了時にも一時ファイルが残らない。利用できない環境では一時ファイルとos.replaceを使用
+        """
+        if self._use_tmpfile:
+            try:
+                fd = os.open(self.output_directory, _O_TMPFILE | os.O_WRONLY, 0o644)
+            except OSError as e:
+                # O_TMPFILE非対応のファイルシステムやカーネルでは以降も従来方式を使用
+                # （権限不足やディレクトリ消失などは従来方式でも失敗するため、そのまま送出）
+                if e.errno not in _O_TMPFILE_UNSUPPORTED_ERRNOS:
+                    raise
+                self._use_tmpfile = False
+            else:
+                try:
+                    self._write_fd(fd, payload)
+                    self._link_tmpfile(fd, filepath)
+                finally:
+                    os.close(fd)
+                self._sync_directory()
+                return
+        
+        # 原子性を保証するため、一時ファイルに書き込み後に置き換え
+        temp_filepath = filepath + ".tmp"
+        try:
+            fd = os.open(temp_filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                self._write_fd(fd, payload)
+            finally:
+                os.close(fd)
+            os.replace(temp_filepath, filepath)
+        except Exception:
             # 一時ファイルのクリーンアップ
             try:
-                if os.path.exists(temp_filepath):
-                    os.remove(temp_filepath)
-            except:
+                os.unlink(temp_filepath)
+            except OSError:
                 pass
-            
-            print(f"エラー: JSONファイル保存中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
             raise
+        self._sync_directory()
+    
+    def _link_tmpfile(self, fd: int, filepath: str):
+        """O_TMPFILEで作成したファイルに名前を付ける"""
+        fd_name = str(fd)
+        try:
+            os.link(fd_name, filepath, src_dir_fd=self._proc_fd_dir, follow_symlinks=True)
+        except FileExistsError:
+            # 同一秒に保存済みの場合は一時名でリンクしてから置き換え（従来のrenameと同じく上書き）
+            temp_filepath = filepath + ".tmp"
+            # 異常終了などで残った同名の一時ファイルがあるとリンクできないため先に削除
+            try:
+                os.unlink(temp_filepath)
+            except FileNotFoundError:
+                pass
+            os.link(fd_name, temp_filepath, src_dir_fd=self._proc_fd_dir, follow_symlinks=True)
+            try:
+                os.replace(temp_filepath, filepath)
+            except Exception:
+                # 一時ファイルのクリーンアップ
+                try:
+                    os.unlink(temp_filepath)
+                except OSError:
+                    pass
+                raise
+    
+    def _write_fd(self, fd: int, payload: bytes):
+        """バイト列をファイルディスクリプタに書き込み、durable_writes有効時はディスクへの書き込みを保証"""
+        # 通常ファイルでは1回のwriteで完了するが、部分書き込みに備えて残りを書き込む
+        view = memoryview(payload)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+        if self.durable_writes:
+            os.fsync(fd)
+    
+    def _sync_directory(self):
+        """durable_writes有効時、ファイル名の追加・置き換えをディスクに反映させるため出力ディレクトリをfsync"""
+        if not self.durable_writes:
+            return
+        dir_fd = os.open(self.output_directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    
+    def _serialize_json(self, data: Dict[str, Any]) -> bytes:
+        """JSONデータをUTF-8バイト列に変換（orjsonが利用可能な場合は優先して使用）
+
+        pretty_outputが無効の場合は空白を含まないコンパクト形式で出力する
+        """
+        if orjson is not None:
+            if self.pretty_output:
+                return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        if self.pretty_output:
+            return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
     
-    def cleanup_old_files(self) -> int:
+    def cleanup_old_files(self, retention: Optional[int] = None) -> int:
         """
         古いファイルを削除して指定件数に制限
+        retentionを省略した場合はfile_retention_countを保持件数とする
         """
         try:
+            keep = retention if retention is not None else self.file_retention_count
+            
             # JSONファイル一覧を取得
             json_files = self._get_json_files()
             
-            if len(json_files) <= self.file_retention_count:
+            if len(json_files) <= keep:
                 return 0  # 削除の必要なし
             
             # 削除対象ファイルの決定
-            files_to_delete = json_files[self.file_retention_count:]
+            files_to_delete = json_files[keep:]
             deleted_count = 0
+            removed_files = set()
             
+            failed_files = []
+            
+            # ファイル毎の出力は行わず、結果をまとめて出力
             for file_path in files_to_delete:
                 try:
-                    os.remove(file_path)
+                    os.unlink(file_path)
                     deleted_count += 1
-                    print(f"古いファイルを削除: {file_path}", file=sys.stderr, flush=True)
+                    removed_files.add(file_path)
+                except FileNotFoundError:
+                    # 既に存在しないファイルはキャッシュからも除外
+                    removed_files.add(file_path)
                 except OSError as e:
-                    print(f"警告: ファイル削除に失敗しました: {file_path} - {repr(e)}", 
-                          file=sys.stderr, flush=True)
+                    failed_files.append(f"{file_path} - {repr(e)}")
+            
+            if failed_files:
+                logger.warning("警告: ファイル削除に失敗しました: %d件\n  %s",
+                               len(failed_files), "\n  ".join(failed_files))
+            
+            # 削除したファイルをキャッシュから除外
+            if self._cached_files is not None:
+                self._cached_files = [f for f in self._cached_files if f not in removed_files]
             
-            print(f"ファイルクリーンアップ完了: {deleted_count}件削除", file=sys.stderr, flush=True)
+            logger.info("ファイルクリーンアップ完了: %d件削除", deleted_count)
             return deleted_count
             
         except Exception as e:
-            print(f"エラー: ファイルクリーンアップ中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("エラー: ファイルクリーンアップ中にエラーが発生しました: %r", e)
             return 0
     
     def check_disk_space(self, min_free_gb: float = 1.0) -> bool:
@@ -112,24 +253,21 @@ class FileManager:
             total, used, free = shutil.disk_usage(self.output_directory)
             
             free_gb = free / (1024 ** 3)
-            total_gb = total / (1024 ** 3)
-            used_gb = used / (1024 ** 3)
-            usage_percent = (used / total) * 100
             
-            print(f"ディスク使用量: {used_gb:.1f}GB / {total_gb:.1f}GB ({usage_percent:.1f}%) " +
-                  f"空き容量: {free_gb:.1f}GB", file=sys.stderr, flush=True)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("ディスク使用量: %.1fGB / %.1fGB (%.1f%%) 空き容量: %.1fGB",
+                             used / (1024 ** 3), total / (1024 ** 3), (used / total) * 100, free_gb)
             
+            # 容量不足の場合のみ出力
             if free_gb < min_free_gb:
-                print(f"警告: ディスク容量不足です。空き容量: {free_gb:.1f}GB (最小要求: {min_free_gb}GB)", 
-                      file=sys.stderr, flush=True)
+                logger.warning("警告: ディスク容量不足です。空き容量: %.1fGB (最小要求: %sGB)",
+                               free_gb, min_free_gb)
                 return False
             
             return True
             
         except Exception as e:
-            print(f"エラー: ディスク容量チェック中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("エラー: ディスク容量チェック中にエラーが発生しました: %r", e)
             return False
     
     def get_file_count(self) -> int:
@@ -143,15 +281,20 @@ class FileManager:
         """出力ディレクトリのサイズを取得（MB単位）"""
         try:
             total_size = 0
-            for dirpath, dirnames, filenames in os.walk(self.output_directory):
-                for filename in filenames:
-                    filepath = os.path.join(dirpath, filename)
-                    if os.path.isfile(filepath):
-                        total_size += os.path.getsize(filepath)
+            pending_dirs = [self.output_directory]
+            
+            # scandirのDirEntryで種別とサイズを取得し、ファイル毎の重複したstatを回避
+            while pending_dirs:
+                with os.scandir(pending_dirs.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending_dirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            total_size += entry.stat(follow_symlinks=False).st_size
+            
             return total_size / (1024 * 1024)
         except Exception as e:
-            print(f"警告: ディレクトリサイズ計算中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
+            logger.warning("警告: ディレクトリサイズ計算中にエラーが発生しました: %r", e)
             return 0.0
     
     def emergency_cleanup(self) -> int:
@@ -160,23 +303,16 @@ class FileManager:
         通常のretention_countより多くのファイルを削除
         """
         try:
-            print("緊急時クリーンアップを開始します", file=sys.stderr, flush=True)
-            
-            # 通常の半分の件数まで削除
-            emergency_retention = max(1, self.file_retention_count // 2)
-            original_retention = self.file_retention_count
+            logger.info("緊急時クリーンアップを開始します")
             
-            self.file_retention_count = emergency_retention
-            deleted_count = self.cleanup_old_files()
-            self.file_retention_count = original_retention
+            # 通常の半分の件数まで削除（保持件数の設定値は変更しない）
+            deleted_count = self.cleanup_old_files(retention=max(1, self.file_retention_count // 2))
             
-            print(f"緊急時クリーンアップ完了: {deleted_count}件削除", file=sys.stderr, flush=True)
+            logger.info("緊急時クリーンアップ完了: %d件削除", deleted_count)
             return deleted_count
             
         except Exception as e:
-            print(f"エラー: 緊急時クリーンアップ中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("エラー: 緊急時クリーンアップ中にエラーが発生しました: %r", e)
             return 0
     
     def _ensure_output_directory(self):
@@ -184,40 +320,50 @@ class FileManager:
         try:
             if not os.path.exists(self.output_directory):
                 os.makedirs(self.output_directory, mode=0o755, exist_ok=True)
-                print(f"出力ディレクトリを作成しました: {self.output_directory}", 
-                      file=sys.stderr, flush=True)
+                logger.info("出力ディレクトリを作成しました: %s", self.output_directory)
         except Exception as e:
-            print(f"エラー: 出力ディレクトリの作成に失敗しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
+            logger.error("エラー: 出力ディレクトリの作成に失敗しました: %r", e)
             raise
     
     def _get_json_files(self) -> List[str]:
-        """出力ディレクトリ内のJSONファイル一覧を作成日時順で取得"""
+        """出力ディレクトリ内のJSONファイル一覧を更新日時順（新しい順）で取得"""
+        if self._cached_files is not None:
+            return list(self._cached_files)
+        
         try:
-            files = []
+            # scandirで走査し、ソートキーは走査時に1回だけ取得する
+            entries = []
+            with os.scandir(self.output_directory) as it:
+                for entry in it:
+                    if entry.name.endswith('.json') and entry.is_file():
+                        entries.append((entry.stat().st_mtime, entry.path))
             
-            for filename in os.listdir(self.output_directory):
-                if filename.endswith('.json') and not filename.endswith('.tmp'):
-                    filepath = os.path.join(self.output_directory, filename)
-                    if os.path.isfile(filepath):
-                        files.append(filepath)
+            # ファイルの更新日時でソート（新しい順）
+            # 保存後に書き換えないため、更新日時の順序は保存順と一致する
+            entries.sort(reverse=True)
+            files = [path for _, path in entries]
             
-            # ファイルの作成日時でソート（新しい順）
-            files.sort(key=lambda x: os.path.getctime(x), reverse=True)
-            return files
+            self._cached_files = files
+            return list(files)
             
         except Exception as e:
-            print(f"警告: JSONファイル一覧取得中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
+            logger.warning("警告: JSONファイル一覧取得中にエラーが発生しました: %r", e)
             return []
 
 
-def create_file_manager(output_directory: str, file_retention_count: int, max_file_size_mb: float) -> FileManager:
+def create_file_manager(output_directory: str, file_retention_count: int, max_file_size_mb: float,
+                        pretty_output: bool = False, durable_writes: bool = False) -> FileManager:
     """ファイルマネージャーを作成"""
-    return FileManager(output_directory, file_retention_count, max_file_size_mb)
+    return FileManager(output_directory, file_retention_count, max_file_size_mb,
+                       pretty_output, durable_writes)
 
 
 if __name__ == "__main__":
+    from datetime import datetime
+    
+    # ログは標準エラー出力へ
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format="%(message)s")
+    
     # テスト実行
     fm = create_file_manager("./test_output", 5, 10.0)
     
@@ -258,4 +404,6 @@ if __name__ == "__main__":
         
     except Exception as e:
         print(f"テスト失敗: {repr(e)}", file=sys.stderr, flush=True)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    finally:
+        fm.close()
\ No newline at end of file
@@ -7,7 +7,9 @@
 import signal
 import sys
 import time
-import traceback
+import logging
+import logging.handlers
+import queue
 import threading
 from pathlib import Path
 
@@ -15,22 +17,33 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from src.config import load_config
-from src.validator import create_validator
-from src.collector import create_collector
-from src.file_manager import create_file_manager
+
+
+logger = logging.getLogger(__name__)
+
+# ディスク容量チェックを行う間隔（メインループの周回数）
+DISK_CHECK_EVERY_LOOPS = 10
 
 
 class ProcessMemoryHistoryDaemon:
     """プロセスメモリ履歴取得デーモンクラス"""
     
     def __init__(self):
-        self.running = True
+        # 停止要求イベント（待機中のスレッドも即座に起床させる）
+        self._stop_event = threading.Event()
         self.config = None
         self.validator = None
         self.collector = None
         self.file_manager = None
-        self.cleanup_thread = None
-        self.last_cleanup_time = 0
+        self._disk_check_counter = 0
+        
+        # ログ出力はキュー経由で別スレッドから行う（メインループではキューへの追加のみ）
+        self._log_listener = self._setup_logging()
+        
+        # ループ内で参照する設定値（initializeで設定）
+        self._interval = 0
+        self._cleanup_interval = 0
+        self._debug = False
         
         # シグナルハンドラーの設定
         signal.signal(signal.SIGTERM, self._signal_handler)
@@ -39,21 +52,32 @@ class ProcessMemoryHistoryDaemon:
     def initialize(self):
         """初期化処理"""
         try:
-            print("プロセスメモリ履歴取得デーモンを初期化中...", file=sys.stderr, flush=True)
+            logger.info("プロセスメモリ履歴取得デーモンを初期化中...")
             
             # 設定の読み込み
             self.config = load_config()
-            print("設定ファイル読み込み完了", file=sys.stderr, flush=True)
+            logger.info("設定ファイル読み込み完了")
+            logging.getLogger().setLevel(self.config.log_level)
+            
+            # ループ内で毎回参照する設定値を保持
+            self._interval = self.config.collection_interval
+            self._cleanup_interval = self.config.cleanup_interval
+            self._debug = self.config.debug_enabled
             
             # セキュリティバリデーターの初期化
+            # 各コンポーネントは設定の検証後に読み込む（設定エラー時の起動コストを抑えるため）
+            from src.validator import create_validator
             self.validator = create_validator(self.config.get_allowed_output_paths())
             
             # セキュリティチェック
             if not self._perform_security_checks():
-                print("セキュリティチェックに失敗しました", file=sys.stderr, flush=True)
+                logger.error("セキュリティチェックに失敗しました")
                 sys.exit(104)
             
             # コンポーネントの初期化
+            from src.collector import create_collector
+            from src.file_manager import create_file_manager
+            
             self.collector = create_collector(
                 self.config.get_top_count(),
                 self.config.get_process_group_by()
@@ -62,163 +86,148 @@ class ProcessMemoryHistoryDaemon:
             self.file_manager = create_file_manager(
                 self.config.get_output_directory(),
                 self.config.get_file_retention_count(),
-                self.config.get_max_file_size_mb()
+                self.config.get_max_file_size_mb(),
+                self.config.is_pretty_output(),
+                self.config.is_durable_writes()
             )
             
-            print("初期化完了", file=sys.stderr, flush=True)
+            logger.info("初期化完了")
             
         except Exception as e:
-            print(f"エラー: 初期化中にエラーが発生しました: {repr(e)}", file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("エラー: 初期化中にエラーが発生しました: %r", e)
             sys.exit(105)
     
     def run(self):
         """メインループの実行"""
         try:
-            print("プロセスメモリ履歴取得デーモン開始", file=sys.stderr, flush=True)
-            print(f"収集間隔: {self.config.get_collection_interval()}秒", file=sys.stderr, flush=True)
-            print(f"上位件数: {self.config.get_top_count()}件", file=sys.stderr, flush=True)
-            print(f"出力ディレクトリ: {self.config.get_output_directory()}", file=sys.stderr, flush=True)
+            logger.info("プロセスメモリ履歴取得デーモン開始")
+            logger.info("収集間隔: %d秒", self._interval)
+            logger.info("上位件数: %d件", self.config.get_top_count())
+            logger.info("出力ディレクトリ: %s", self.config.get_output_directory())
             
-            # クリーンアップスレッドの開始
-            self._start_cleanup_thread()
+            # 定期クリーンアップの次回実行時刻（起動後最初の収集時に1回実行）
+            next_cleanup_time = time.monotonic()
             
             # メインループ
-            while self.running:
+            while not self._stop_event.is_set():
                 try:
-                    loop_start_time = time.time()
+                    loop_start_time = time.monotonic()
                     
                     # メモリ情報の収集
                     memory_data = self.collector.collect()
                     
-                    # ディスク容量チェック
-                    if not self.file_manager.check_disk_space():
-                        print("ディスク容量不足のため緊急クリーンアップを実行", file=sys.stderr, flush=True)
-                        self.file_manager.emergency_cleanup()
+                    # ディスク容量チェック（容量は緩やかにしか変化しないため数回に1回のみ実行）
+                    if self._disk_check_counter == 0:
+                        if not self.file_manager.check_disk_space():
+                            logger.warning("ディスク容量不足のため緊急クリーンアップを実行")
+                            self.file_manager.emergency_cleanup()
+                    self._disk_check_counter = (self._disk_check_counter + 1) % DISK_CHECK_EVERY_LOOPS
                     
                     # JSONファイルの保存
                     saved_file = self.file_manager.save_json(memory_data)
                     
-                    if self.config.is_debug_enabled():
-                        print(f"データ収集完了: {len(memory_data['items'])}件, " +
-                              f"総メモリ: {memory_data['total_mb']}MB, " +
-                              f"ファイル: {saved_file}", file=sys.stderr, flush=True)
+                    # 定期クリーンアップ（専用スレッドを持たずメインループ内で実行）
+                    if time.monotonic() >= next_cleanup_time:
+                        self._run_cleanup()
+                        next_cleanup_time = time.monotonic() + self._cleanup_interval
+                    
+                    if self._debug:
+                        logger.info("データ収集完了: %d件, 総メモリ: %sMB, ファイル: %s",
+                                    len(memory_data['items']), memory_data['total_mb'], saved_file)
                     
                     # インターバル計算（処理時間を考慮）
-                    processing_time = time.time() - loop_start_time
-                    sleep_time = max(0, self.config.get_collection_interval() - processing_time)
+                    processing_time = time.monotonic() - loop_start_time
+                    sleep_time = max(0, self._interval - processing_time)
                     
-                    # 1秒間隔で中断フラグをチェックしながら待機
-                    elapsed_sleep = 0
-                    while elapsed_sleep < sleep_time and self.running:
-                        time.sleep(min(1, sleep_time - elapsed_sleep))
-                        elapsed_sleep += 1
+                    # 次の収集まで待機（停止要求があれば即座に復帰）
+                    self._stop_event.wait(timeout=sleep_time)
                     
                 except KeyboardInterrupt:
                     break
                 except Exception as e:
-                    print(f"エラー: メインループ中にエラーが発生しました: {repr(e)}", 
-                          file=sys.stderr, flush=True)
-                    if self.config.is_debug_enabled():
-                        traceback.print_exc(file=sys.stderr)
+                    logger.error("エラー: メインループ中にエラーが発生しました: %r", e,
+                                 exc_info=self._debug)
                     
-                    # エラー発生時は少し待ってから再試行（1秒間隔で中断チェック）
-                    error_sleep_time = min(10, self.config.get_collection_interval())
-                    elapsed_sleep = 0
-                    while elapsed_sleep < error_sleep_time and self.running:
-                        time.sleep(1)
-                        elapsed_sleep += 1
+                    # エラー発生時は少し待ってから再試行（停止要求があれば即座に復帰）
+                    self._stop_event.wait(timeout=min(10, self._interval))
             
         except Exception as e:
-            print(f"エラー: メインループで致命的なエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("エラー: メインループで致命的なエラーが発生しました: %r", e)
             sys.exit(106)
     
     def stop(self):
         """デーモンの停止"""
-        if self.running:
-            print("プロセスメモリ履歴取得デーモンを停止中...", file=sys.stderr, flush=True)
-            self.running = False
-
-            # クリーンアップスレッドの停止
-            if self.cleanup_thread and self.cleanup_thread.is_alive():
-                self.cleanup_thread.join(timeout=2)
+        if not self._stop_event.is_set():
+            logger.info("プロセスメモリ履歴取得デーモンを停止中...")
+            self._stop_event.set()
             
-            print("プロセスメモリ履歴取得デーモン停止完了", file=sys.stderr, flush=True)
+            logger.info("プロセスメモリ履歴取得デーモン停止完了")
+    
+    def stop_logging(self):
+        """キューに残っているログを出力してからリスナーを停止（終了直前に1回だけ呼び出す）"""
+        self._log_listener.stop()
+    
+    def _setup_logging(self) -> logging.handlers.QueueListener:
+        """キュー経由のロガーを設定してリスナーを開始"""
+        # SimpleQueueはシグナルハンドラーからの再入でもデッドロックしない
+        log_queue = queue.SimpleQueue()
+        
+        stream_handler = logging.StreamHandler(sys.stderr)
+        stream_handler.setFormatter(logging.Formatter("%(message)s"))
+        
+        root_logger = logging.getLogger()
+        root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        root_logger.setLevel(logging.INFO)
+        
+        listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        listener.start()
+        return listener
     
     def _signal_handler(self, signum, frame):
         """シグナルハンドラー"""
         signal_names = {signal.SIGTERM: "SIGTERM", signal.SIGINT: "SIGINT"}
         signal_name = signal_names.get(signum, f"Signal {signum}")
-        print(f"{signal_name}を受信しました。デーモンを停止します。", file=sys.stderr, flush=True)
+        logger.info("%sを受信しました。デーモンを停止します。", signal_name)
         self.stop()
     
     def _perform_security_checks(self) -> bool:
         """セキュリティチェックの実行"""
         try:
-            print("セキュリティチェックを実行中...", file=sys.stderr, flush=True)
-            
-            # 実行権限チェック
-            if not self.validator.validate_execution_permissions():
-                return False
+            logger.info("セキュリティチェックを実行中...")
             
-            # 出力ディレクトリチェック
-            if not self.validator.validate_output_directory(self.config.get_output_directory()):
+            # 実行権限・出力ディレクトリ・設定ファイル権限（警告のみ）を一括でチェック
+            # （実行権限チェックに失敗した場合、出力ディレクトリは作成されない）
+            report = self.validator.validate_all(
+                check_execution=True,
+                output_dirs=(self.config.get_output_directory(),),
+                config_path="settings.json"
+            )
+            if not report.ok:
                 return False
             
-            # 設定ファイル権限チェック（警告のみ）
-            self.validator.validate_config_file_permissions("settings.json")
-            
-            print("セキュリティチェック完了", file=sys.stderr, flush=True)
+            logger.info("セキュリティチェック完了")
             return True
             
         except Exception as e:
-            print(f"エラー: セキュリティチェック中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("エラー: セキュリティチェック中にエラーが発生しました: %r", e)
             return False
     
-    def _start_cleanup_thread(self):
-        """クリーンアップスレッドの開始"""
-        def cleanup_worker():
-            counter = 0
-            while self.running:
-                try:
-                    counter += 1
-                    
-                    # 60回に1回（60秒に1回）クリーンアップ間隔をチェック
-                    if counter >= 60:
-                        counter = 0
-                        current_time = time.time()
-                        
-                        # クリーンアップ間隔チェック
-                        if current_time - self.last_cleanup_time >= self.config.get_cleanup_interval():
-                            print("定期クリーンアップを実行中...", file=sys.stderr, flush=True)
-                            
-                            deleted_count = self.file_manager.cleanup_old_files()
-                            self.last_cleanup_time = current_time
-                            
-                            # 統計情報の出力
-                            file_count = self.file_manager.get_file_count()
-                            dir_size = self.file_manager.get_directory_size_mb()
-                            print(f"クリーンアップ完了: {deleted_count}件削除, " +
-                                  f"残りファイル: {file_count}件, " +
-                                  f"ディレクトリサイズ: {dir_size:.2f}MB", file=sys.stderr, flush=True)
-                    
-                    # 1秒間隔でチェック
-                    time.sleep(1)
-                    
-                except Exception as e:
-                    print(f"警告: クリーンアップスレッドでエラーが発生しました: {repr(e)}", 
-                          file=sys.stderr, flush=True)
-                    if self.config.is_debug_enabled():
-                        traceback.print_exc(file=sys.stderr)
-                    time.sleep(1)
-        
-        self.cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
-        self.cleanup_thread.start()
-        print("クリーンアップスレッド開始", file=sys.stderr, flush=True)
+    def _run_cleanup(self):
+        """古いファイルの定期クリーンアップ"""
+        try:
+            logger.info("定期クリーンアップを実行中...")
+            
+            deleted_count = self.file_manager.cleanup_old_files()
+            
+            # 統計情報の出力
+            file_count = self.file_manager.get_file_count()
+            dir_size = self.file_manager.get_directory_size_mb()
+            logger.info("クリーンアップ完了: %d件削除, 残りファイル: %d件, ディレクトリサイズ: %.2fMB",
+                        deleted_count, file_count, dir_size)
+            
+        except Exception as e:
+            logger.warning("警告: 定期クリーンアップでエラーが発生しました: %r", e,
+                           exc_info=self._debug)
 
 
 def main():
@@ -233,11 +242,15 @@ def main():
     except SystemExit:
         pass
     except Exception as e:
-        print(f"致命的エラー: {repr(e)}", file=sys.stderr, flush=True)
-        traceback.print_exc(file=sys.stderr)
+        logger.exception("致命的エラー: %r", e)
         sys.exit(107)
     finally:
         daemon.stop()
+        if daemon.file_manager is not None:
+            daemon.file_manager.close()
+        
+        # stop()はシグナルハンドラーから周期の途中で呼ばれるため、リスナーはここで停止
+        daemon.stop_logging()
 
 
 if __name__ == "__main__":
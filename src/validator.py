@@ -4,95 +4,163 @@
 出力ディレクトリの安全性チェックやファイル権限チェックを行う
 """
 
+import functools
+import logging
 import os
+import re
 import sys
 import stat
-import traceback
-from pathlib import Path
-from typing import List
+import time
+from collections import OrderedDict
+from typing import ClassVar, FrozenSet, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# URLエンコードされたディレクトリトラバーサルのパターン（".."、"/"、"\\"）
+# IGNORECASEにより小文字化したコピーを作らずに判定する
+_ENCODED_TRAVERSAL_RE = re.compile(r"%2e%2e|%2f|%5c", re.IGNORECASE)
+
+# 許可パスがこの件数以上の場合はパス要素単位のトライ木で判定する
+ALLOW_TRIE_MIN_PATHS = 8
+
+# トライ木のノードが許可パスの終端であることを示すキー
+_ALLOWED = object()
+
+# 書き込み可否の判定結果をキャッシュする秒数（書き込み可／不可）と最大件数
+WRITABLE_CACHE_TTL = 60.0
+WRITABLE_NEGATIVE_CACHE_TTL = 5.0
+WRITABLE_CACHE_MAX_ENTRIES = 256
+
+
+@functools.lru_cache(maxsize=None)
+def _is_root() -> bool:
+    """root権限で実行されているか（UIDはプロセス内で変更しないため初回の結果を再利用）"""
+    return os.getuid() == 0
+
+
+def _stat(path: str) -> Optional[os.stat_result]:
+    """1回のstatでファイル情報を取得（存在しない場合はNone）"""
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+class ValidationReport:
+    """一括バリデーションの結果（警告は結果の成否に影響しない）"""
+    
+    def __init__(self):
+        self.ok = True
+        self.errors = []
+        self.warnings = []
+    
+    def add_error(self, message: str):
+        """エラーを追加して結果を失敗にする"""
+        self.ok = False
+        self.errors.append(message)
+    
+    def add_warning(self, message: str):
+        """警告を追加"""
+        self.warnings.append(message)
 
 
 class SecurityValidator:
     """セキュリティバリデーションクラス"""
     
-    # システムディレクトリ（書き込み禁止）
-    SYSTEM_DIRECTORIES = {
+    # システムディレクトリ（書き込み禁止）。完全一致の判定にもそのまま使用する
+    SYSTEM_DIRECTORIES: ClassVar[FrozenSet[str]] = frozenset({
         "/etc", "/usr", "/var", "/bin", "/sbin", "/boot", "/dev", "/proc", "/sys",
         "/lib", "/lib64", "/run", "/root"
-    }
+    })
+    
+    # 前方一致判定用（区切り文字付きで"/etchost"等の誤検出を防ぐ）
+    _SYS_PREFIXES = tuple(d + "/" for d in SYSTEM_DIRECTORIES)
+    # これより短いパスはいずれのシステムディレクトリにも該当しない
+    _SYS_MIN_LEN = min(len(d) for d in SYSTEM_DIRECTORIES)
     
     def __init__(self, allowed_output_paths: List[str]):
         """
         許可された出力パスで初期化
         """
-        self.allowed_output_paths = [os.path.abspath(path) for path in allowed_output_paths]
+        self.allowed_output_paths = [self._abspath(path) for path in allowed_output_paths]
+        
+        # 許可パスの判定用に正規化済みのプレフィックスを構築時に1回だけ作成
+        self._allowed_prefixes = tuple(path.rstrip("/") + "/" for path in self.allowed_output_paths)
+        self._allowed_exact = frozenset(self.allowed_output_paths)
+        
+        # 許可パスが多い場合は判定時間が件数に依存しないようトライ木を構築
+        self._allow_trie = None
+        if len(self.allowed_output_paths) >= ALLOW_TRIE_MIN_PATHS:
+            self._allow_trie = self._build_allow_trie(self.allowed_output_paths)
+        
+        # ディレクトリ毎の書き込み可否の判定結果（判定時刻, 結果）。古いものから削除する
+        self._writable_cache = OrderedDict()
+        
+        # パス文字列のみによる判定（トラバーサル、システムディレクトリ、許可パス）の結果をキャッシュ
+        # 書き込み可否は権限変更に追従するため含めず、_check_directory_writableのTTL付きキャッシュで判定する
+        self._check_path_policy = functools.lru_cache(maxsize=256)(self._check_path_policy_impl)
     
     def validate_output_directory(self, directory: str) -> bool:
         """
         出力ディレクトリの安全性をチェック
         """
+        return self._check_output_directory(directory) is None
+    
+    def _check_output_directory(self, directory: str) -> Optional[str]:
+        """出力ディレクトリの安全性をチェックし、問題がある場合はその理由を返す（問題が無い場合はNone）"""
         try:
-            abs_dir = os.path.abspath(directory)
-            
-            # ディレクトリトラバーサル攻撃の検出
-            if self._has_directory_traversal(directory):
-                print(f"セキュリティエラー: ディレクトリトラバーサルが検出されました: {directory}", 
-                      file=sys.stderr, flush=True)
-                return False
-            
-            # システムディレクトリへの書き込み禁止
-            if self._is_system_directory(abs_dir):
-                print(f"セキュリティエラー: システムディレクトリへの書き込みは禁止されています: {abs_dir}", 
-                      file=sys.stderr, flush=True)
-                return False
-            
-            # 許可された出力パスかチェック
-            if not self._is_allowed_output_path(abs_dir):
-                print(f"セキュリティエラー: 許可されていない出力パスです: {abs_dir}", 
-                      file=sys.stderr, flush=True)
-                print(f"許可されたパス: {self.allowed_output_paths}", file=sys.stderr, flush=True)
-                return False
+            abs_dir, reason = self._check_path_policy(directory)
             
             # ディレクトリの作成権限チェック
-            if not self._check_directory_writable(abs_dir):
-                print(f"セキュリティエラー: ディレクトリに書き込み権限がありません: {abs_dir}", 
-                      file=sys.stderr, flush=True)
-                return False
-            
-            return True
+            if reason is None and not self._check_directory_writable(abs_dir):
+                reason = f"ディレクトリに書き込み権限がありません: {abs_dir}"
             
+        except OSError as e:
+            # ファイルシステム由来の想定内のエラーはトレースバックを出力しない
+            reason = f"ディレクトリバリデーション中にエラーが発生しました: {e}"
         except Exception as e:
-            print(f"セキュリティエラー: ディレクトリバリデーション中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
-            return False
+            reason = f"ディレクトリバリデーション中にエラーが発生しました: {e!r}"
+            logger.exception("セキュリティエラー: %s", reason)
+            return reason
+        
+        if reason is not None:
+            logger.error("セキュリティエラー: %s", reason)
+        return reason
+    
+    def _check_path_policy_impl(self, directory: str) -> Tuple[str, Optional[str]]:
+        """
+        パス文字列のみで判定できるチェック（ファイルシステムにはアクセスしない）
+        絶対パスと、拒否する場合はその理由を返す（稼働中にカレントディレクトリは変更しない前提）
+        """
+        abs_dir = self._abspath(directory)
+        
+        # ディレクトリトラバーサル攻撃の検出
+        if self._has_directory_traversal(directory):
+            return abs_dir, f"ディレクトリトラバーサルが検出されました: {directory}"
+        
+        # システムディレクトリへの書き込み禁止
+        if self._is_system_directory(abs_dir):
+            return abs_dir, f"システムディレクトリへの書き込みは禁止されています: {abs_dir}"
+        
+        # 許可された出力パスかチェック
+        if not self._is_allowed_output_path(abs_dir):
+            return abs_dir, (f"許可されていない出力パスです: {abs_dir}\n"
+                             f"許可されたパス: {self.allowed_output_paths}")
+        
+        return abs_dir, None
     
     def validate_config_file_permissions(self, config_path: str) -> bool:
         """
         設定ファイルの権限をチェック
         """
         try:
-            if not os.path.exists(config_path):
-                print(f"警告: 設定ファイルが存在しません: {config_path}", file=sys.stderr, flush=True)
-                return False
-            
-            file_stat = os.stat(config_path)
-            file_mode = stat.filemode(file_stat.st_mode)
-            octal_mode = oct(file_stat.st_mode)[-3:]
-            
-            # 推奨権限: 600 (所有者のみ読み書き可能)
-            if octal_mode != "600":
-                print(f"警告: 設定ファイルの権限が推奨値(600)ではありません: {config_path} ({file_mode}, {octal_mode})", 
-                      file=sys.stderr, flush=True)
-                print(f"推奨: chmod 600 {config_path}", file=sys.stderr, flush=True)
-                return False
-            
-            return True
+            return self._check_config_file_stat(config_path, _stat(config_path)) is None
             
+        except OSError as e:
+            logger.error("エラー: 設定ファイル権限チェック中にエラーが発生しました: %s", e)
+            return False
         except Exception as e:
-            print(f"エラー: 設定ファイル権限チェック中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("エラー: 設定ファイル権限チェック中にエラーが発生しました: %r", e)
             return False
     
     def validate_execution_permissions(self) -> bool:
@@ -101,62 +169,108 @@ class SecurityValidator:
         """
         try:
             # 一般ユーザー権限での実行を確認
-            if os.getuid() == 0:
-                print("警告: root権限で実行されています。セキュリティリスクがあります。", 
-                      file=sys.stderr, flush=True)
+            if _is_root():
+                logger.warning("警告: root権限で実行されています。セキュリティリスクがあります。")
                 return False
             
             return True
             
+        except OSError as e:
+            logger.error("エラー: 実行権限チェック中にエラーが発生しました: %s", e)
+            return False
         except Exception as e:
-            print(f"エラー: 実行権限チェック中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
+            logger.exception("エラー: 実行権限チェック中にエラーが発生しました: %r", e)
             return False
     
+    def _abspath(self, path: str) -> str:
+        """絶対パスに変換（絶対パスはカレントディレクトリと結合せず、getcwdを呼ばずに正規化のみ行う）"""
+        if path.startswith(os.sep):
+            return os.path.normpath(path)
+        return os.path.abspath(path)
+    
     def _has_directory_traversal(self, path: str) -> bool:
         """ディレクトリトラバーサル攻撃の検出"""
-        # 危険なパターンをチェック
-        dangerous_patterns = ["../", "..\\", "..", "%2e%2e", "%2f", "%5c"]
-        normalized_path = path.lower()
-        
-        for pattern in dangerous_patterns:
-            if pattern in normalized_path:
-                return True
+        # ".."は"../"と"..\\"も包含する
+        if ".." in path:
+            return True
         
-        return False
+        # URLエンコードのパターンは"%"を含む場合のみ検索
+        return "%" in path and _ENCODED_TRAVERSAL_RE.search(path) is not None
     
     def _is_system_directory(self, abs_path: str) -> bool:
         """システムディレクトリかチェック"""
-        for sys_dir in self.SYSTEM_DIRECTORIES:
-            if abs_path.startswith(sys_dir):
-                return True
-        return False
+        if len(abs_path) < self._SYS_MIN_LEN:
+            return False
+        return abs_path in self.SYSTEM_DIRECTORIES or abs_path.startswith(self._SYS_PREFIXES)
     
     def _is_allowed_output_path(self, abs_path: str) -> bool:
         """許可された出力パスかチェック"""
-        for allowed_path in self.allowed_output_paths:
-            # 許可されたパス内またはそのサブディレクトリかチェック
-            if abs_path.startswith(allowed_path):
+        if self._allow_trie is not None:
+            return self._is_allowed_by_trie(abs_path)
+        
+        # 許可されたパスそのものまたはそのサブディレクトリかチェック
+        return abs_path in self._allowed_exact or abs_path.startswith(self._allowed_prefixes)
+    
+    @staticmethod
+    def _build_allow_trie(allowed_paths: List[str]) -> dict:
+        """許可パスをパス要素単位のトライ木に変換"""
+        trie = {}
+        for path in allowed_paths:
+            node = trie
+            for part in path.split(os.sep):
+                if part:
+                    node = node.setdefault(part, {})
+            node[_ALLOWED] = True
+        return trie
+    
+    def _is_allowed_by_trie(self, abs_path: str) -> bool:
+        """トライ木を辿り、許可パスそのものまたはその配下かチェック"""
+        node = self._allow_trie
+        if _ALLOWED in node:
+            return True
+        
+        for part in abs_path.split(os.sep):
+            if not part:
+                continue
+            node = node.get(part)
+            if node is None:
+                return False
+            if _ALLOWED in node:
                 return True
         return False
     
     def _check_directory_writable(self, directory: str) -> bool:
-        """ディレクトリが書き込み可能かチェック"""
+        """
+        ディレクトリが書き込み可能かチェック
+        判定結果は一定時間キャッシュする（書き込み不可の結果は権限変更に追従できるよう短時間のみ）
+        """
+        now = time.monotonic()
+        cached = self._writable_cache.get(directory)
+        if cached is not None:
+            checked_at, writable = cached
+            ttl = WRITABLE_CACHE_TTL if writable else WRITABLE_NEGATIVE_CACHE_TTL
+            if now - checked_at < ttl:
+                self._writable_cache.move_to_end(directory)
+                return writable
+        
+        writable = self._probe_directory_writable(directory)
+        self._writable_cache[directory] = (now, writable)
+        self._writable_cache.move_to_end(directory)
+        if len(self._writable_cache) > WRITABLE_CACHE_MAX_ENTRIES:
+            self._writable_cache.popitem(last=False)
+        return writable
+    
+    def _probe_directory_writable(self, directory: str) -> bool:
+        """
+        ディレクトリの書き込み可否を実際に確認
+        テストファイルを作成せず、実効UID（実行中のユーザー）の権限をfaccessatで1回だけ確認する
+        """
         try:
-            # ディレクトリが存在しない場合は作成を試行
-            if not os.path.exists(directory):
-                os.makedirs(directory, mode=0o755, exist_ok=True)
+            # ディレクトリが存在しない場合は作成を試行（存在する場合はmakedirs内で処理される）
+            os.makedirs(directory, mode=0o755, exist_ok=True)
             
-            # 書き込み権限をテスト
-            test_file = os.path.join(directory, ".write_test")
-            try:
-                with open(test_file, 'w') as f:
-                    f.write("test")
-                os.remove(test_file)
-                return True
-            except OSError:
-                return False
+            # ファイル作成には書き込み権限と検索（実行）権限が必要
+            return os.access(directory, os.W_OK | os.X_OK, effective_ids=True)
                 
         except Exception:
             return False
@@ -166,23 +280,112 @@ class SecurityValidator:
         ファイルサイズが制限内かチェック
         """
         try:
-            if not os.path.exists(file_path):
-                return True  # ファイルが存在しない場合はOK
+            return self._check_file_size_stat(file_path, _stat(file_path), max_size_mb) is None
             
-            file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
+        except OSError as e:
+            logger.error("エラー: ファイルサイズチェック中にエラーが発生しました: %s", e)
+            return False
+        except Exception as e:
+            logger.exception("エラー: ファイルサイズチェック中にエラーが発生しました: %r", e)
+            return False
+    
+    def validate_all(self, *, config_path: Optional[str] = None, output_dirs: Iterable[str] = (),
+                     file_size_checks: Iterable[Tuple[str, float]] = (),
+                     check_execution: bool = False) -> ValidationReport:
+        """
+        複数のバリデーションを一括で実行
+        同じファイルに対する権限チェックとサイズチェックでは1回のstat結果を共有する
+        失敗理由はerrorsに、設定ファイル権限の問題は警告としてwarningsに格納する
+        実行権限チェックに失敗した場合は出力ディレクトリのチェック（ディレクトリ作成）を行わない
+        """
+        report = ValidationReport()
+        stat_cache = {}
+        
+        def stat_once(path: str) -> Optional[os.stat_result]:
+            key = self._abspath(path)
+            if key not in stat_cache:
+                stat_cache[key] = _stat(path)
+            return stat_cache[key]
+        
+        try:
+            execution_ok = True
+            if check_execution and not self.validate_execution_permissions():
+                execution_ok = False
+                report.add_error("実行権限: root権限で実行されています")
             
-            if file_size_mb > max_size_mb:
-                print(f"エラー: ファイルサイズが制限を超えています: {file_path} ({file_size_mb:.2f}MB > {max_size_mb}MB)", 
-                      file=sys.stderr, flush=True)
-                return False
+            # 実行ユーザーが不正な場合は出力ディレクトリを作成しないようチェックを行わない
+            if execution_ok:
+                for directory in output_dirs:
+                    reason = self._check_output_directory(directory)
+                    if reason is not None:
+                        report.add_error(f"出力ディレクトリ: {reason}")
             
-            return True
+            # 設定ファイル権限は警告のみ（statの失敗も警告として扱う）
+            if config_path is not None:
+                try:
+                    reason = self._check_config_file_stat(config_path, stat_once(config_path))
+                except OSError as e:
+                    reason = f"設定ファイル権限チェック中にエラーが発生しました: {e}"
+                    logger.warning("警告: %s", reason)
+                if reason is not None:
+                    report.add_warning(f"設定ファイル権限: {reason}")
+            
+            for file_path, max_size_mb in file_size_checks:
+                try:
+                    reason = self._check_file_size_stat(file_path, stat_once(file_path), max_size_mb)
+                except OSError as e:
+                    reason = f"ファイルサイズチェック中にエラーが発生しました: {file_path}: {e}"
+                    logger.error("エラー: %s", reason)
+                if reason is not None:
+                    report.add_error(f"ファイルサイズ: {reason}")
             
         except Exception as e:
-            print(f"エラー: ファイルサイズチェック中にエラーが発生しました: {repr(e)}", 
-                  file=sys.stderr, flush=True)
-            traceback.print_exc(file=sys.stderr)
-            return False
+            logger.exception("エラー: 一括バリデーション中にエラーが発生しました: %r", e)
+            report.add_error(repr(e))
+        
+        return report
+    
+    def _check_config_file_stat(self, config_path: str, file_stat: Optional[os.stat_result]) -> Optional[str]:
+        """取得済みのstat結果から設定ファイルの権限をチェックし、問題がある場合はその理由を返す"""
+        if file_stat is None:
+            reason = f"設定ファイルが存在しません: {config_path}"
+            logger.warning("警告: %s", reason)
+            return reason
+        
+        # 推奨権限: 600 (所有者のみ読み書き可能)。表示用の文字列は警告時のみ作成
+        if (file_stat.st_mode & 0o777) != 0o600:
+            reason = (f"設定ファイルの権限が推奨値(600)ではありません: {config_path} "
+                      f"({stat.filemode(file_stat.st_mode)}, {file_stat.st_mode & 0o777:03o})")
+            logger.warning("警告: %s", reason)
+            logger.warning("推奨: chmod 600 %s", config_path)
+            return reason
+        
+        return None
+    
+    def _check_file_size_stat(self, file_path: str, file_stat: Optional[os.stat_result],
+                              max_size_mb: float) -> Optional[str]:
+        """取得済みのstat結果からファイルサイズが制限内かチェックし、超えている場合はその理由を返す"""
+        if file_stat is None:
+            return None  # ファイルが存在しない場合はOK
+        
+        file_size_mb = file_stat.st_size / (1024 * 1024)
+        
+        if file_size_mb > max_size_mb:
+            reason = f"ファイルサイズが制限を超えています: {file_path} ({file_size_mb:.2f}MB > {max_size_mb}MB)"
+            logger.error("エラー: %s", reason)
+            return reason
+        
+        return None
+
+
+# モジュール単体実行時のテストケース（パス, 期待値）
+_SELF_TEST_CASES = (
+    ("./output", True),
+    ("/tmp/process_memory", True),
+    ("../../../etc", False),
+    ("/etc/passwd", False),
+    ("./output/../../../root", False),
+)
 
 
 def create_validator(allowed_output_paths: List[str]) -> SecurityValidator:
@@ -191,25 +394,25 @@ def create_validator(allowed_output_paths: List[str]) -> SecurityValidator:
 
 
 if __name__ == "__main__":
-    # テスト実行
-    validator = create_validator(["./output", "/tmp/process_memory"])
+    # テスト実行（ログは標準エラー出力へ）
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format="%(message)s")
     
-    print("=== セキュリティバリデーションテスト ===", file=sys.stderr, flush=True)
+    validator = create_validator(["./output", "/tmp/process_memory"])
     
-    # 正常なパステスト
-    test_cases = [
-        ("./output", True),
-        ("/tmp/process_memory", True),
-        ("../../../etc", False),
-        ("/etc/passwd", False),
-        ("./output/../../../root", False),
-    ]
+    # 見出しは各チェックのログより前に出力し、結果はまとめて1回で出力
+    sys.stderr.write("=== セキュリティバリデーションテスト ===\n")
+    sys.stderr.flush()
+    lines = []
     
-    for test_path, expected in test_cases:
+    # パステスト
+    for test_path, expected in _SELF_TEST_CASES:
         result = validator.validate_output_directory(test_path)
         status = "OK" if result == expected else "NG"
-        print(f"{status}: {test_path} -> {result} (期待値: {expected})", file=sys.stderr, flush=True)
+        lines.append(f"{status}: {test_path} -> {result} (期待値: {expected})")
     
     # 実行権限テスト
     exec_result = validator.validate_execution_permissions()
-    print(f"実行権限チェック: {exec_result}", file=sys.stderr, flush=True)
\ No newline at end of file
+    lines.append(f"実行権限チェック: {exec_result}")
+    
+    sys.stderr.write("\n".join(lines) + "\n")
+    sys.stderr.flush()
\ No newline at end of file
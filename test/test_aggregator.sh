@@ -193,7 +193,33 @@ test_tsv_content() {
 
 run_test "TSVファイル内容検証" "test_tsv_content"
 
-# テスト10: PID重複処理テスト
+# テスト10: 縦持ち形式TSV出力テスト
+test_long_format() {
+    python3 bin/aggregate.py --hours 1 --format long --data-dir "$TEST_OUTPUT_DIR" --output test_1h_long.tsv >/dev/null 2>&1 || return 1
+    
+    python3 -c "
+with open('test_1h_long.tsv', 'r', encoding='utf-8') as f:
+    lines = f.read().split('\n')
+
+# ヘッダーと列数のチェック
+assert lines[0] == '時間\tPID\t始値\t高値\t安値\t終値', f'Unexpected header: {lines[0]}'
+rows = lines[1:]
+assert all(len(row.split('\t')) == 6 for row in rows), 'Unexpected column count'
+
+# 行数が横持ち形式で値のあるローソク足の数と一致するかチェック
+with open('test_1h.tsv', 'r', encoding='utf-8') as f:
+    wide_rows = f.read().split('\n')[1:]
+expected = sum(1 for row in wide_rows for cell in row.split('\t')[1::4] if cell)
+assert expected > 0, 'No candles in wide TSV'
+assert len(rows) == expected, f'Expected {expected} rows, got {len(rows)}'
+
+print('縦持ち形式TSV: OK')
+" 2>/dev/null
+}
+
+run_test "縦持ち形式TSV出力テスト" "test_long_format"
+
+# テスト11: PID重複処理テスト
 test_pid_duplication() {
     python3 -c "
 import sys
@@ -126,6 +126,390 @@ print('セキュリティテスト: OK')
 
 run_test "セキュリティテスト" "test_security"
 
+# テスト11: JSON整形出力設定テスト
+test_pretty_output() {
+    python3 -c "
+import sys, json, os, shutil
+sys.path.insert(0, '.')
+from src.config import Config
+from src.file_manager import create_file_manager
+
+test_dir = './test_output_pretty'
+settings_path = './settings_test_pretty.json'
+shutil.rmtree(test_dir, ignore_errors=True)
+try:
+    # 設定値の読み込みとバリデーション
+    config = json.load(open('settings.json'))
+    config['output']['pretty_output'] = True
+    json.dump(config, open(settings_path, 'w'))
+    assert Config(settings_path).is_pretty_output() is True
+    
+    config['output']['pretty_output'] = 'yes'
+    json.dump(config, open(settings_path, 'w'))
+    try:
+        Config(settings_path)
+        assert False, 'Invalid pretty_output was accepted'
+    except SystemExit as e:
+        assert e.code == 103, f'Unexpected exit code: {e.code}'
+    
+    data = {'timestamp': 'test', 'items': [{'pid': 1, 'cmd': 'テスト', 'rss': 100}]}
+    
+    # デフォルトはコンパクト形式（改行・インデント無し）
+    compact_file = create_file_manager(test_dir, 10, 10.0).save_json(data)
+    compact = open(compact_file, 'rb').read()
+    assert b'\\n' not in compact and b': ' not in compact, compact
+    assert json.loads(compact) == data
+    os.remove(compact_file)
+    
+    # pretty_output有効時はインデント付き
+    pretty_file = create_file_manager(test_dir, 10, 10.0, pretty_output=True).save_json(data)
+    pretty = open(pretty_file, 'rb').read()
+    assert b'\\n  ' in pretty, pretty
+    assert json.loads(pretty) == data
+finally:
+    shutil.rmtree(test_dir, ignore_errors=True)
+    if os.path.exists(settings_path):
+        os.remove(settings_path)
+
+print('JSON整形出力設定テスト: OK')
+" 2>/dev/null
+}
+
+run_test "JSON整形出力設定テスト" "test_pretty_output"
+
+# テスト12: ディスク同期（durable_writes）設定テスト
+test_durable_writes() {
+    python3 -c "
+import sys, json, os, shutil
+sys.path.insert(0, '.')
+from src.config import Config
+from src.file_manager import create_file_manager
+
+test_dir = './test_output_durable'
+settings_path = './settings_test_durable.json'
+shutil.rmtree(test_dir, ignore_errors=True)
+
+# os.fsyncの呼び出し回数を記録
+fsync_calls = []
+real_fsync = os.fsync
+def counting_fsync(fd):
+    fsync_calls.append(fd)
+    real_fsync(fd)
+os.fsync = counting_fsync
+
+def count_fsync(fm, use_tmpfile):
+    fm._use_tmpfile = use_tmpfile and fm._proc_fd_dir is not None
+    del fsync_calls[:]
+    saved_file = fm.save_json({'timestamp': 'test', 'items': []})
+    os.remove(saved_file)
+    return len(fsync_calls)
+
+try:
+    # 設定値の読み込みとバリデーション
+    config = json.load(open('settings.json'))
+    config['output']['durable_writes'] = True
+    json.dump(config, open(settings_path, 'w'))
+    assert Config(settings_path).is_durable_writes() is True
+    
+    config['output']['durable_writes'] = 1
+    json.dump(config, open(settings_path, 'w'))
+    try:
+        Config(settings_path)
+        assert False, 'Invalid durable_writes was accepted'
+    except SystemExit as e:
+        assert e.code == 103, f'Unexpected exit code: {e.code}'
+    
+    # O_TMPFILE方式・一時ファイル方式の両方で確認
+    for use_tmpfile in (True, False):
+        # デフォルトはfsyncしない
+        fm = create_file_manager(test_dir, 10, 10.0)
+        assert count_fsync(fm, use_tmpfile) == 0
+        fm.close()
+        
+        # durable_writes有効時はファイルとディレクトリをfsync
+        fm = create_file_manager(test_dir, 10, 10.0, durable_writes=True)
+        assert count_fsync(fm, use_tmpfile) == 2
+        fm.close()
+    
+    # 一時ファイルが残っていないこと
+    assert os.listdir(test_dir) == [], os.listdir(test_dir)
+finally:
+    os.fsync = real_fsync
+    shutil.rmtree(test_dir, ignore_errors=True)
+    if os.path.exists(settings_path):
+        os.remove(settings_path)
+
+print('ディスク同期設定テスト: OK')
+" 2>/dev/null
+}
+
+run_test "ディスク同期設定テスト" "test_durable_writes"
+
+# テスト13: 書き込み可否キャッシュテスト
+test_writable_cache() {
+    python3 -c "
+import sys, os, shutil, types
+sys.path.insert(0, '.')
+import src.validator as validator_module
+from src.validator import create_validator, WRITABLE_CACHE_TTL, WRITABLE_NEGATIVE_CACHE_TTL
+
+test_dir = os.path.abspath('./test_output_writable')
+shutil.rmtree(test_dir, ignore_errors=True)
+
+# 時刻と権限を差し替え（root権限ではchmodに関わらずos.accessが成功するため）
+clock = [1000.0]
+writable = [False]
+probes = []
+real_access = os.access
+def fake_access(path, mode, **kwargs):
+    if path == test_dir:
+        probes.append(path)
+        return writable[0]
+    return real_access(path, mode, **kwargs)
+validator_module.time = types.SimpleNamespace(monotonic=lambda: clock[0])
+os.access = fake_access
+
+try:
+    validator = create_validator([test_dir])
+    
+    # 書き込み不可（chmod 500相当）
+    assert validator.validate_output_directory(test_dir) is False
+    assert len(probes) == 1
+    
+    # 権限を戻しても（chmod 700相当）否定結果の有効期間内はキャッシュを使用
+    writable[0] = True
+    clock[0] += WRITABLE_NEGATIVE_CACHE_TTL - 1
+    assert validator.validate_output_directory(test_dir) is False
+    assert len(probes) == 1
+    
+    # 有効期間を過ぎた否定結果は再確認される
+    clock[0] += 2
+    assert validator.validate_output_directory(test_dir) is True
+    assert len(probes) == 2
+    
+    # 肯定結果はより長い有効期間の間キャッシュされ、過ぎると再確認される
+    writable[0] = False
+    clock[0] += WRITABLE_CACHE_TTL - 1
+    assert validator.validate_output_directory(test_dir) is True
+    assert len(probes) == 2
+    clock[0] += 2
+    assert validator.validate_output_directory(test_dir) is False
+    assert len(probes) == 3
+finally:
+    os.access = real_access
+    shutil.rmtree(test_dir, ignore_errors=True)
+
+print('書き込み可否キャッシュテスト: OK')
+" 2>/dev/null
+}
+
+run_test "書き込み可否キャッシュテスト" "test_writable_cache"
+
+# テスト14: 許可パスのトライ木判定テスト
+test_allow_trie() {
+    python3 -c "
+import sys
+sys.path.insert(0, '.')
+from src.validator import create_validator, ALLOW_TRIE_MIN_PATHS
+
+allowed = ['/tmp/a', '/tmp/b/c', '/srv/data', '/srv/logs/app', '/home/user/out',
+           '/opt/pmh', '/mnt/x/y/z', '/data']
+assert len(allowed) >= ALLOW_TRIE_MIN_PATHS
+
+queries = ['/tmp/a', '/tmp/a/', '/tmp/a/b', '/tmp/ab', '/tmp/ab/c', '/tmp', '/tmp/b',
+           '/tmp/b/c', '/tmp/b/cd', '/tmp/b/c/d/e', '/srv', '/srv/data2', '/srv/data/x',
+           '/srv/logs', '/srv/logs/app/1', '/mnt/x/y', '/mnt/x/y/z', '/data', '/database',
+           '/', '/home/user', '/home/user/out/2024']
+
+def linear(validator, abs_path):
+    # 件数が少ない場合の前方一致判定
+    return abs_path in validator._allowed_exact or abs_path.startswith(validator._allowed_prefixes)
+
+for paths in (allowed, allowed + ['/']):
+    validator = create_validator(paths)
+    assert validator._allow_trie is not None
+    for query in queries:
+        abs_path = validator._abspath(query)
+        expected = linear(validator, abs_path)
+        assert validator._is_allowed_output_path(abs_path) == expected, (paths, query)
+
+# 兄弟ディレクトリ・完全一致・ルート許可の個別確認
+validator = create_validator(allowed)
+assert validator._is_allowed_output_path('/tmp/a')
+assert validator._is_allowed_output_path('/tmp/a/b')
+assert not validator._is_allowed_output_path('/tmp/ab')
+assert not validator._is_allowed_output_path('/tmp')
+assert create_validator(allowed + ['/'])._is_allowed_output_path('/anything/below/root')
+
+print('許可パスのトライ木判定テスト: OK')
+" 2>/dev/null
+}
+
+run_test "許可パスのトライ木判定テスト" "test_allow_trie"
+
+# テスト15: 一括バリデーションテスト
+test_validate_all() {
+    python3 -c "
+import sys, os, shutil
+sys.path.insert(0, '.')
+from src.validator import create_validator
+
+test_dir = os.path.abspath('./test_output_validate_all')
+config_path = os.path.join(test_dir, 'settings.json')
+shutil.rmtree(test_dir, ignore_errors=True)
+
+# 同じファイルに対するstatの回数を記録
+stat_calls = []
+real_stat = os.stat
+def counting_stat(path, *args, **kwargs):
+    if path == config_path:
+        stat_calls.append(path)
+    return real_stat(path, *args, **kwargs)
+os.stat = counting_stat
+
+try:
+    os.makedirs(test_dir)
+    with open(config_path, 'w') as f:
+        f.write('x' * 2048)
+    validator = create_validator([test_dir])
+    
+    # 問題が無い場合
+    os.chmod(config_path, 0o600)
+    report = validator.validate_all(config_path=config_path, output_dirs=(test_dir,),
+                                    file_size_checks=((config_path, 1.0),))
+    assert report.ok and report.errors == [] and report.warnings == [], vars(report)
+    
+    # 権限チェックとサイズチェックで1回のstatを共有
+    assert len(stat_calls) == 1, stat_calls
+    
+    # 設定ファイル権限は警告のみ、サイズ超過と不正な出力ディレクトリはエラー（理由を含む）
+    os.chmod(config_path, 0o644)
+    report = validator.validate_all(config_path=config_path, output_dirs=(test_dir, '/etc', '../x'),
+                                    file_size_checks=((config_path, 0.001),))
+    assert report.ok is False
+    assert len(report.errors) == 3, report.errors
+    assert 'システムディレクトリ' in report.errors[0] and '/etc' in report.errors[0], report.errors
+    assert 'ディレクトリトラバーサル' in report.errors[1], report.errors
+    assert report.errors[2].startswith('ファイルサイズ: ') and config_path in report.errors[2], report.errors
+    assert len(report.warnings) == 1 and '推奨値(600)' in report.warnings[0], report.warnings
+    
+    # 警告のみの場合は成功
+    report = validator.validate_all(config_path=config_path)
+    assert report.ok and report.errors == [] and len(report.warnings) == 1, vars(report)
+finally:
+    os.stat = real_stat
+    shutil.rmtree(test_dir, ignore_errors=True)
+
+print('一括バリデーションテスト: OK')
+" 2>/dev/null
+}
+
+run_test "一括バリデーションテスト" "test_validate_all"
+
+# テスト16: 一括バリデーションの失敗時動作テスト
+test_validate_all_failures() {
+    python3 -c "
+import sys, os, shutil
+sys.path.insert(0, '.')
+import src.validator as validator_module
+from src.validator import create_validator
+
+test_dir = os.path.abspath('./test_output_validate_fail')
+output_dir = os.path.join(test_dir, 'output')
+config_path = os.path.join(test_dir, 'settings.json')
+shutil.rmtree(test_dir, ignore_errors=True)
+
+real_stat = os.stat
+real_is_root = validator_module._is_root
+try:
+    os.makedirs(test_dir)
+    validator = create_validator([test_dir])
+    
+    # 実行権限チェックに失敗した場合は出力ディレクトリを作成しない
+    validator_module._is_root = lambda: True
+    report = validator.validate_all(check_execution=True, output_dirs=(output_dir,))
+    assert report.ok is False and len(report.errors) == 1, report.errors
+    assert report.errors[0].startswith('実行権限: '), report.errors
+    assert not os.path.exists(output_dir)
+    
+    # 実行権限チェックが成功した場合は作成される
+    validator_module._is_root = lambda: False
+    report = validator.validate_all(check_execution=True, output_dirs=(output_dir,))
+    assert report.ok and os.path.isdir(output_dir), vars(report)
+    
+    # 設定ファイルのstat失敗は警告のみとし、他のチェックは継続する
+    def failing_stat(path, *args, **kwargs):
+        if path == config_path:
+            raise PermissionError(13, 'Permission denied', path)
+        return real_stat(path, *args, **kwargs)
+    os.stat = failing_stat
+    report = validator.validate_all(config_path=config_path, output_dirs=(output_dir, '/etc'))
+    assert len(report.warnings) == 1 and 'Permission denied' in report.warnings[0], report.warnings
+    assert len(report.errors) == 1 and '/etc' in report.errors[0], report.errors
+    
+    report = validator.validate_all(config_path=config_path)
+    assert report.ok and report.errors == [] and len(report.warnings) == 1, vars(report)
+finally:
+    os.stat = real_stat
+    validator_module._is_root = real_is_root
+    shutil.rmtree(test_dir, ignore_errors=True)
+
+print('一括バリデーション失敗時動作テスト: OK')
+" 2>/dev/null
+}
+
+run_test "一括バリデーション失敗時動作テスト" "test_validate_all_failures"
+
+# テスト17: 同一秒保存時の一時ファイルテスト
+test_same_second_save() {
+    python3 -c "
+import sys, os, shutil
+sys.path.insert(0, '.')
+import src.file_manager as file_manager_module
+from src.file_manager import create_file_manager
+
+test_dir = './test_output_same_second'
+shutil.rmtree(test_dir, ignore_errors=True)
+
+# ファイル名を固定して同一秒の保存を再現
+file_manager_module.time.strftime = lambda template: 'memory_20250101_000000.json'
+filepath = os.path.join(test_dir, 'memory_20250101_000000.json')
+real_replace = os.replace
+
+try:
+    fm = create_file_manager(test_dir, 10, 10.0)
+    fm.save_json({'n': 1})
+    
+    # 異常終了で残った一時ファイルがあっても上書き保存できる
+    with open(filepath + '.tmp', 'w') as f:
+        f.write('stale')
+    fm.save_json({'n': 2})
+    assert os.listdir(test_dir) == ['memory_20250101_000000.json'], os.listdir(test_dir)
+    assert open(filepath).read() == '{\"n\":2}'
+    
+    # 置き換えに失敗しても一時ファイルを残さない
+    def failing_replace(src, dst):
+        raise OSError(5, 'Input/output error')
+    os.replace = failing_replace
+    try:
+        fm.save_json({'n': 3})
+        assert False, 'save_json did not raise'
+    except OSError:
+        pass
+    os.replace = real_replace
+    assert os.listdir(test_dir) == ['memory_20250101_000000.json'], os.listdir(test_dir)
+    assert open(filepath).read() == '{\"n\":2}'
+    fm.close()
+finally:
+    os.replace = real_replace
+    shutil.rmtree(test_dir, ignore_errors=True)
+
+print('同一秒保存時の一時ファイルテスト: OK')
+" 2>/dev/null
+}
+
+run_test "同一秒保存時の一時ファイルテスト" "test_same_second_save"
+
 # テスト結果サマリー
 echo ""
 echo "=== テスト結果サマリー ==="